@@ -26,6 +26,9 @@ elif auth_type == "auth":
 
     auth = Auth()
 
+EXCLUDED_PATHS = ('/api/v1/status/', '/api/v1/unauthorized/',
+                  '/api/v1/forbidden/')
+
 
 # before_request handler
 @app.before_request
@@ -37,10 +40,8 @@ def before_request():
     - Checks if the request path is part of the excluded paths.
     - Verifies the authorization header and the current user.
     """
-    excluded_paths = ['/api/v1/status/', '/api/v1/unauthorized/', '/api/v1/forbidden/']
-
     if auth:
-        if not auth.require_auth(request.path, excluded_paths):
+        if not auth.require_auth(request.path, EXCLUDED_PATHS):
             return  # No authentication needed for this path
 
         # Check if Authorization header is present
@@ -2,8 +2,60 @@
 """
 Auth class module for managing API authentication.
 """
+import re
 from flask import request
-from typing import List, TypeVar
+from functools import lru_cache
+from typing import Callable, List, Tuple, TypeVar
+
+
+@lru_cache(maxsize=32)
+def _compile_excluded_paths(
+        excluded_paths: Tuple[str]) -> Callable[[str], bool]:
+    """
+    Compiles excluded paths into a single pattern and returns a
+    function telling if a path requires authentication.
+    Decisions for the most recent paths are memoized.
+    """
+    alternatives = []
+    for excluded_path in excluded_paths:
+        excluded_path = excluded_path.rstrip('/')
+        if excluded_path.endswith('*'):
+            # Prefix match
+            alternatives.append(re.escape(excluded_path[:-1]))
+        else:
+            # Exact match, with a trailing slash
+            alternatives.append(re.escape(excluded_path + '/') + r'\Z')
+    pattern = re.compile('|'.join(alternatives))
+
+    @lru_cache(maxsize=4096)
+    def require_auth(path: str) -> bool:
+        """
+        Tells if a path matches none of the excluded paths.
+        """
+        path = path if path.endswith('/') else path + '/'
+        return pattern.match(path) is None
+
+    return require_auth
+
+
+# Last (excluded paths tuple, compiled matcher) pair, to skip hashing
+# the same tuple on every request
+_last_compiled = (None, None)
+
+
+def _excluded_paths_matcher(excluded_paths: List[str]) -> Callable:
+    """
+    Returns the compiled matcher for excluded paths.
+    """
+    global _last_compiled
+    last_paths, matcher = _last_compiled
+    if excluded_paths is last_paths:
+        return matcher
+    if type(excluded_paths) is not tuple:
+        return _compile_excluded_paths(tuple(excluded_paths))
+    matcher = _compile_excluded_paths(excluded_paths)
+    _last_compiled = (excluded_paths, matcher)
+    return matcher
 
 
 class Auth:
@@ -19,19 +71,7 @@ class Auth:
         if path is None or not excluded_paths:
             return True
 
-        path = path if path.endswith('/') else path + '/'
-
-        for excluded_path in excluded_paths:
-            excluded_path = excluded_path.rstrip('/')
-            if excluded_path.endswith('*'):
-                pattern = excluded_path[:-1]
-                if path.startswith(pattern):
-                    return False
-            else:
-                excluded_path = excluded_path + '/'
-                if path == excluded_path:
-                    return False
-        return True
+        return _excluded_paths_matcher(excluded_paths)(path)
 
     def authorization_header(self, request=None) -> str:
         """
@@ -5,16 +5,39 @@ BasicAuth module for managing basic authentication.
 
 from api.v1.auth.auth import Auth
 import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
 from typing import TypeVar, Tuple
 from models.user import User
 
+try:
+    AUTH_CACHE_SIZE = int(getenv("AUTH_CACHE_SIZE", 1024))
+    AUTH_CACHE_TTL = float(getenv("AUTH_CACHE_TTL", 60))
+except ValueError:
+    AUTH_CACHE_SIZE = 1024
+    AUTH_CACHE_TTL = 60
+
 
 class BasicAuth(Auth):
     """
     BasicAuth class that inherits from Auth.
     Implements Basic Authentication methods.
+    Verified credentials are cached (LRU, AUTH_CACHE_TTL seconds)
+    by digest of the Authorization header.
     """
 
+    def __init__(self):
+        """
+        Initializes an empty credential cache.
+        """
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
     def extract_base64_authorization_header(self,
                                             authorization_header: str) -> str:
         """
@@ -100,6 +123,11 @@ class BasicAuth(Auth):
         if not auth_header:
             return None
 
+        cache_key = hashlib.sha256(auth_header.encode('utf-8')).digest()
+        user = self._cached_user(cache_key)
+        if user is not None:
+            return user
+
         base64_auth = self.extract_base64_authorization_header(auth_header)
         if not base64_auth:
             return None
@@ -112,4 +140,60 @@ class BasicAuth(Auth):
         if not email or not pwd:
             return None
 
-        return self.user_object_from_credentials(email, pwd)
\ No newline at end of file
+        user = self.user_object_from_credentials(email, pwd)
+        if user is not None:
+            self._cache_user(cache_key, user)
+        return user
+
+    def _cached_user(self, cache_key: bytes) -> TypeVar('User'):
+        """
+        Returns the cached User for an Authorization header digest.
+        An entry is dropped once expired, or when its User has been
+        removed or its email or password changed since it was verified.
+        """
+        with self._cache_lock:
+            entry = self._cache.get(cache_key)
+            if entry is None:
+                self.cache_misses += 1
+                return None
+        # Looked up outside the lock, which would otherwise serialize
+        # every authenticated request (and its query with DBStorage)
+        user_id, email, password, expires_at = entry
+        user = User.get(user_id) if time.monotonic() < expires_at \
+            else None
+        valid = user is not None and user.email == email and \
+            user.password == password
+        with self._cache_lock:
+            # Unless replaced meanwhile
+            if self._cache.get(cache_key) is entry:
+                if valid:
+                    self._cache.move_to_end(cache_key)
+                else:
+                    del self._cache[cache_key]
+            if not valid:
+                self.cache_misses += 1
+                return None
+            self.cache_hits += 1
+        return user
+
+    def _cache_user(self, cache_key: bytes, user: TypeVar('User')):
+        """
+        Caches a verified User for an Authorization header digest.
+        """
+        if AUTH_CACHE_SIZE <= 0 or AUTH_CACHE_TTL <= 0:
+            return
+        with self._cache_lock:
+            self._cache[cache_key] = (user.id, user.email, user.password,
+                                      time.monotonic() + AUTH_CACHE_TTL)
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > AUTH_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def cache_stats(self) -> dict:
+        """
+        Returns the hit/miss counters of the credential cache.
+        """
+        with self._cache_lock:
+            return {'hits': self.cache_hits,
+                    'misses': self.cache_misses,
+                    'size': len(self._cache)}
\ No newline at end of file
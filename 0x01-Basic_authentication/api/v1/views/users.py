@@ -2,18 +2,107 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from bisect import bisect_right
+from flask import abort, jsonify, request, Response
 from models.user import User
+import json
+
+
+PAGE_SIZE = 100
+# User attributes that GET and batch requests can filter on
+FILTER_ATTRIBUTES = ('id', 'email', 'first_name', 'last_name')
+
+
+def _stream_users(users: list):
+    """ Yield the JSON array of `users` one User at a time
+    """
+    yield "["
+    for i, user in enumerate(users):
+        if i > 0:
+            yield ","
+        yield user.to_json_string()
+    yield "]\n"
+
+
+def _not_modified(etag: str) -> Response:
+    """ Return a 304 response if the request's If-None-Match holds `etag`
+    """
+    if etag not in request.if_none_match:
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def _page(users: list, limit: int, cursor: str = None) -> tuple:
+    """ Paginate a list of Users by ID, like User.page()
+    """
+    users = sorted(users, key=lambda user: user.id)
+    start = 0
+    if cursor is not None:
+        start = bisect_right([user.id for user in users], cursor)
+    next_cursor = None
+    if start + limit < len(users):
+        next_cursor = users[start + limit - 1].id
+    return users[start:start + limit], next_cursor
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters:
+      - id, email, first_name, last_name (optional): only return the
+        Users with these attribute values
+      - limit (optional): maximum number of Users to return
+      - cursor (optional): ID of the last User of the previous page
+      - stream (optional): 1 to stream the list instead of buffering it
     Return:
-      - list of all User objects JSON represented
+      - list of all (matching) User objects JSON represented, ordered
+        by ID when paginated
+      - X-Next-Cursor header holding the cursor of the next page
+      - X-Query-Plan header telling how the filters were applied:
+        "index <attribute>" or "scan"
+      - ETag header, changing with every mutation of the Users
+      - 304 if If-None-Match holds the current ETag
+      - 400 if limit isn't a positive integer
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    attributes = {k: v for k, v in request.args.items()
+                  if k in FILTER_ATTRIBUTES}
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    next_cursor = None
+    if limit is not None or cursor is not None:
+        try:
+            limit = PAGE_SIZE if limit is None else int(limit)
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            return jsonify({'error': "limit must be a positive integer"}), 400
+
+    etag = User.etag()
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    if attributes:
+        users = User.search(attributes)
+        if limit is not None:
+            users, next_cursor = _page(users, limit, cursor)
+    elif limit is None:
+        users = User.all()
+    else:
+        users, next_cursor = User.page(limit, cursor)
+
+    if request.args.get('stream') == "1":
+        response = Response(_stream_users(users), mimetype="application/json")
+    else:
+        response = Response("".join(_stream_users(users)),
+                            mimetype="application/json")
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    if attributes:
+        response.headers['X-Query-Plan'] = User.explain(attributes)
+    response.set_etag(etag)
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -23,14 +112,24 @@ def view_one_user(user_id: str = None) -> str:
       - User ID
     Return:
       - User object JSON represented
+      - ETag header, changing with every mutation of the User
+      - 304 if If-None-Match holds the current ETag
       - 404 if the User ID doesn't exist
     """
     if user_id is None:
         abort(404)
+    # The tag before the lookup, so that it is never newer than the user
+    etag = User.etag(user_id)
     user = User.get(user_id)
     if user is None:
         abort(404)
-    return jsonify(user.to_json())
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    response = Response(user.to_json_string() + "\n",
+                        mimetype="application/json")
+    response.set_etag(etag)
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -64,24 +163,13 @@ def create_user() -> str:
       - 400 if can't create the new User
     """
     rj = None
-    error_msg = None
     try:
         rj = request.get_json()
     except Exception as e:
         rj = None
-    if rj is None:
-        error_msg = "Wrong format"
-    if error_msg is None and rj.get("email", "") == "":
-        error_msg = "email missing"
-    if error_msg is None and rj.get("password", "") == "":
-        error_msg = "password missing"
+    user, error_msg = _new_user(rj)
     if error_msg is None:
         try:
-            user = User()
-            user.email = rj.get("email")
-            user.password = rj.get("password")
-            user.first_name = rj.get("first_name")
-            user.last_name = rj.get("last_name")
             user.save()
             return jsonify(user.to_json()), 201
         except Exception as e:
@@ -89,6 +177,80 @@ def create_user() -> str:
     return jsonify({'error': error_msg}), 400
 
 
+def _batch_items() -> list:
+    """ Return the items of a batch request body: a JSON array, or one
+    JSON object per line when sent as application/x-ndjson. An item
+    that isn't valid JSON is None; the body itself is None if invalid.
+    """
+    if request.mimetype == "application/x-ndjson":
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            if line.strip() == "":
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+    items = request.get_json(silent=True)
+    if type(items) is not list:
+        return None
+    return items
+
+
+@app_views.route('/users/batch', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/batch
+    Body: JSON array (or NDJSON) of User objects, each with the JSON
+    parameters of POST /api/v1/users
+    Return:
+      - created: list of the created User objects JSON represented
+      - errors: list of the index and error of the rejected items
+      - 400 if the body isn't an array or no User can be created
+    """
+    items = _batch_items()
+    if items is None:
+        return jsonify({'error': "Wrong format"}), 400
+    users = []
+    errors = []
+    for i, rj in enumerate(items):
+        user, error_msg = _new_user(rj)
+        if error_msg is None:
+            users.append(user)
+        else:
+            errors.append({'index': i, 'error': error_msg})
+    try:
+        User.save_many(users)
+    except Exception as e:
+        return jsonify({'error': "Can't create Users: {}".format(e)}), 400
+    status = 400 if len(users) == 0 and len(errors) > 0 else 201
+    return jsonify({'created': [user.to_json() for user in users],
+                    'errors': errors}), status
+
+
+def _new_user(rj: dict) -> tuple:
+    """ Build an unsaved User from the JSON body of a creation request
+    Return:
+      - the User, None on error
+      - the error message, None on success
+    """
+    if type(rj) is not dict:
+        return None, "Wrong format"
+    if rj.get("email", "") == "":
+        return None, "email missing"
+    if rj.get("password", "") == "":
+        return None, "password missing"
+    try:
+        user = User()
+        user.email = rj.get("email")
+        user.password = rj.get("password")
+        user.first_name = rj.get("first_name")
+        user.last_name = rj.get("last_name")
+    except Exception as e:
+        return None, "Can't create User: {}".format(e)
+    return user, None
+
+
 @app_views.route('/users/<user_id>', methods=['PUT'], strict_slashes=False)
 def update_user(user_id: str = None) -> str:
     """ PUT /api/v1/users/:id
@@ -114,9 +276,99 @@ def update_user(user_id: str = None) -> str:
         rj = None
     if rj is None:
         return jsonify({'error': "Wrong format"}), 400
+    # A copy, as stored instances are shared with the readers
+    user = User(**user.to_json(True))
     if rj.get('first_name') is not None:
         user.first_name = rj.get('first_name')
     if rj.get('last_name') is not None:
         user.last_name = rj.get('last_name')
     user.save()
     return jsonify(user.to_json()), 200
+
+
+def _batch_targets(rj: dict) -> tuple:
+    """ Find the Users targeted by a batch request body: either `ids`,
+    a list of User IDs, or `filter`, the attributes to search for
+    Return:
+      - the list of Users found
+      - the list of missing IDs
+      - the error message, None on success
+    """
+    if type(rj) is not dict:
+        return [], [], "Wrong format"
+    ids = rj.get('ids')
+    attributes = rj.get('filter')
+    if (ids is None) == (attributes is None):
+        return [], [], "ids or filter missing"
+    if attributes is not None:
+        if type(attributes) is not dict or len(attributes) == 0 or \
+                any(k not in FILTER_ATTRIBUTES for k in attributes):
+            return [], [], "filter must be an object of {}".format(
+                ", ".join(FILTER_ATTRIBUTES))
+        return User.search(attributes), [], None
+    if type(ids) is not list or any(type(i) is not str for i in ids):
+        return [], [], "ids must be a list of strings"
+    users = []
+    missing = []
+    for user_id in dict.fromkeys(ids):
+        user = User.get(user_id)
+        if user is None:
+            missing.append(user_id)
+        else:
+            users.append(user)
+    return users, missing, None
+
+
+@app_views.route('/users/batch', methods=['PATCH'], strict_slashes=False)
+def update_users() -> str:
+    """ PATCH /api/v1/users/batch
+    JSON body:
+      - ids: list of User IDs, or filter: attributes of the Users
+      - update: JSON parameters of PUT /api/v1/users/:id
+    Return:
+      - updated: list of the updated User IDs
+      - missing: list of the User IDs not found
+      - 400 if can't update the Users
+    """
+    rj = request.get_json(silent=True)
+    users, missing, error_msg = _batch_targets(rj)
+    if error_msg is None and type(rj.get('update')) is not dict:
+        error_msg = "update missing"
+    if error_msg is not None:
+        return jsonify({'error': error_msg}), 400
+    update = rj.get('update')
+    # Copies, saved at once, as stored instances are shared with the readers
+    users = [User(**user.to_json(True)) for user in users]
+    for user in users:
+        if update.get('first_name') is not None:
+            user.first_name = update.get('first_name')
+        if update.get('last_name') is not None:
+            user.last_name = update.get('last_name')
+    try:
+        User.save_many(users)
+    except Exception as e:
+        return jsonify({'error': "Can't update Users: {}".format(e)}), 400
+    return jsonify({'updated': [user.id for user in users],
+                    'missing': missing}), 200
+
+
+@app_views.route('/users/batch', methods=['DELETE'], strict_slashes=False)
+def delete_users() -> str:
+    """ DELETE /api/v1/users/batch
+    JSON body:
+      - ids: list of User IDs, or filter: attributes of the Users
+    Return:
+      - deleted: list of the deleted User IDs
+      - missing: list of the User IDs not found
+      - 400 if can't delete the Users
+    """
+    users, missing, error_msg = _batch_targets(
+        request.get_json(silent=True))
+    if error_msg is not None:
+        return jsonify({'error': error_msg}), 400
+    try:
+        User.remove_many(users)
+    except Exception as e:
+        return jsonify({'error': "Can't delete Users: {}".format(e)}), 400
+    return jsonify({'deleted': [user.id for user in users],
+                    'missing': missing}), 200
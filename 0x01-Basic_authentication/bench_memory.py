@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+""" Memory used by users loaded from JSON records, measured with
+tracemalloc: the slotted User against a plain object with a __dict__
+and datetime timestamps, as User was stored before
+
+Usage: ./bench_memory.py [count...]  (default: 100000 1000000)
+"""
+from datetime import datetime
+from models.user import User
+import gc
+import json
+import sys
+import tracemalloc
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class DictUser():
+    """ User stored in a __dict__, with datetime timestamps
+    """
+
+    def __init__(self, **kwargs):
+        """ Initialize a DictUser instance from a JSON record
+        """
+        for key, value in kwargs.items():
+            if key in ('created_at', 'updated_at'):
+                value = datetime.strptime(value, TIMESTAMP_FORMAT)
+            setattr(self, key, value)
+
+
+def records_json(count: int) -> str:
+    """ JSON text of `count` user records
+    """
+    return json.dumps([{
+        'id': '{:08d}-aaaa-bbbb-cccc-dddddddddddd'.format(i),
+        'created_at': '2020-01-01T00:00:00',
+        'updated_at': '2020-01-01T00:00:00',
+        'email': 'u{}@x.io'.format(i),
+        '_password': '{:064d}'.format(i),
+        'first_name': 'Bob',
+        'last_name': 'Smith'} for i in range(count)])
+
+
+def measure(cls: type, text: str) -> int:
+    """ Bytes held by the instances of `cls` built from `text`
+    """
+    gc.collect()
+    tracemalloc.start()
+    records = json.loads(text)
+    objs = [cls(**record) for record in records]
+    del records
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return size
+
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    for count in counts:
+        text = records_json(count)
+        for cls in (DictUser, User):
+            size = measure(cls, text)
+            print("{:>8} x {:<8}: {:7.1f} MB, {:4.0f} B/user".format(
+                cls.__name__, count, size / 1e6, size / count))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+""" Auth.require_auth against the loop over excluded paths it replaced:
+checks that both take the same decisions, then times them
+
+Usage: ./bench_require_auth.py [excluded paths count]  (default: 300, half
+of them prefixes ending in '*')
+"""
+from api.v1.auth.auth import Auth
+from typing import List
+import random
+import sys
+import time
+
+
+def loop_require_auth(path: str, excluded_paths: List[str]) -> bool:
+    """ Previous implementation of Auth.require_auth
+    """
+    if path is None or not excluded_paths:
+        return True
+
+    path = path if path.endswith('/') else path + '/'
+
+    for excluded_path in excluded_paths:
+        excluded_path = excluded_path.rstrip('/')
+        if excluded_path.endswith('*'):
+            pattern = excluded_path[:-1]
+            if path.startswith(pattern):
+                return False
+        else:
+            excluded_path = excluded_path + '/'
+            if path == excluded_path:
+                return False
+    return True
+
+
+def random_path(rand: random.Random) -> str:
+    """ A short random path, likely to share prefixes with others
+    """
+    return "/api/v1/" + "/".join(rand.choice(["stat", "status", "users",
+                                              "u1", "u2", "x"])
+                                 for _ in range(rand.randint(0, 3))) + \
+        rand.choice(["", "/", "*"])
+
+
+def timed(require_auth, paths: List[str], excluded_paths: tuple) -> float:
+    """ Microseconds per call of require_auth over `paths`
+    """
+    start = time.perf_counter()
+    for path in paths:
+        require_auth(path, excluded_paths)
+    return (time.perf_counter() - start) / len(paths) * 1e6
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    rand = random.Random(0)
+    auth = Auth()
+
+    for _ in range(200):
+        excluded_paths = [random_path(rand) for _ in range(5)]
+        for _ in range(50):
+            path = random_path(rand).rstrip('*')
+            assert auth.require_auth(path, excluded_paths) == \
+                loop_require_auth(path, excluded_paths), \
+                (path, excluded_paths)
+    print("Same decisions on 10000 random paths")
+
+    excluded_paths = tuple(
+        ["/api/v1/prefix{}/*".format(i) for i in range(count // 2)] +
+        ["/api/v1/exact{}/".format(i) for i in range(count - count // 2)])
+    repeated = ["/api/v1/users/{}".format(i % 100) for i in range(100000)]
+    distinct = ["/api/v1/users/{}".format(i) for i in range(100000)]
+    print("{} excluded paths, us per call:".format(count))
+    print("  loop:                {:.2f}".format(
+        timed(loop_require_auth, repeated, excluded_paths)))
+    print("  compiled, distinct:  {:.2f}".format(
+        timed(auth.require_auth, distinct, excluded_paths)))
+    print("  compiled, repeated:  {:.2f}".format(
+        timed(auth.require_auth, repeated, excluded_paths)))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+""" Startup time of the file storage engine: load_from_file() of N users
+from a JSON snapshot (eager and LAZY_LOAD) and from a binary snapshot,
+each in a new process
+
+Usage: ./bench_startup.py [count]  (default: 100000)
+"""
+from os import environ, path
+from models.engine.snapshot import json_to_snapshot
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+
+MODES = {
+    'json, eager': {},
+    'json, lazy': {'LAZY_LOAD': '1'},
+    'binary': {'SNAPSHOT_FORMAT': 'binary'},
+}
+
+
+def write_users(count: int, directory: str):
+    """ Write .db_User.json and .db_User.bin with `count` users in
+    `directory`
+    """
+    objs_json = {}
+    for i in range(count):
+        obj_id = str(uuid.uuid4())
+        objs_json[obj_id] = {'id': obj_id,
+                             'created_at': '2020-01-01T00:00:00',
+                             'updated_at': '2020-01-01T00:00:00',
+                             'email': 'u{}@x.io'.format(i),
+                             '_password': 'a' * 64,
+                             'first_name': 'Bob',
+                             'last_name': 'Smith'}
+    json_path = path.join(directory, '.db_User.json')
+    with open(json_path, 'w') as f:
+        json.dump(objs_json, f)
+    json_to_snapshot(json_path, path.join(directory, '.db_User.bin'),
+                     ('email',))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--load']:
+        start = time.perf_counter()
+        from models.user import User
+        User.load_from_file()
+        print(time.perf_counter() - start)
+        sys.exit()
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    script = path.abspath(__file__)
+    with tempfile.TemporaryDirectory() as tmp:
+        write_users(count, tmp)
+        print("load_from_file() of {} users:".format(count))
+        for mode, env in MODES.items():
+            seconds = subprocess.run(
+                [sys.executable, script, '--load'], cwd=tmp,
+                env=dict(environ, **env), check=True, capture_output=True,
+                text=True).stdout
+            print("  {:<12} {:.2f}s".format(mode, float(seconds)))
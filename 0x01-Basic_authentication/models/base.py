@@ -1,39 +1,139 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from datetime import datetime, timedelta, timezone
+from typing import TypeVar, List, Iterable, Tuple
+from models.engine import storage
+import itertools
 import json
+import threading
+import time
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+EPOCH = datetime(1970, 1, 1)
+# Slotted attributes of each model class, in declaration order
+FIELDS = {}
+# Encoder of to_json_string(), built once
+ENCODER = json.JSONEncoder(sort_keys=True)
+_setattr = object.__setattr__
+# Versions: sequence numbers of the mutations, by class name, of the last
+# mutation, of the last load and of the last mutation of each object since
+# then, for the storage engines that keep no versions of their own.
+# BOOT_ID keeps the entity tags of a previous run from matching.
+BOOT_ID = uuid.uuid4().hex[:12]
+CLASS_VERSIONS = {}
+LOAD_VERSIONS = {}
+OBJECT_VERSIONS = {}
+_sequence = itertools.count(1)
+_versions_lock = threading.Lock()
+
+
+def _to_epoch(value) -> int:
+    """ Convert a datetime (or its ISO string) to UTC epoch seconds
+    """
+    if value is None:
+        return None
+    if type(value) is str:
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(seconds=1)
+
+
+def _bump(cls, obj_ids: Iterable[str] = None):
+    """ Record a mutation of the objects `obj_ids` of a class, or the
+    load of all of them when None
+    """
+    s_class = cls.__name__
+    with _versions_lock:
+        version = next(_sequence)
+        CLASS_VERSIONS[s_class] = version
+        if obj_ids is None:
+            LOAD_VERSIONS[s_class] = version
+            OBJECT_VERSIONS[s_class] = {}
+            return
+        versions = OBJECT_VERSIONS.setdefault(s_class, {})
+        for obj_id in obj_ids:
+            versions[obj_id] = version
+
+
+def _fields(cls) -> tuple:
+    """ Return the slotted attributes of a model class, except the
+    serialization cache
+    """
+    fields = FIELDS.get(cls)
+    if fields is None:
+        fields = []
+        for klass in reversed(cls.__mro__):
+            fields.extend(attr for attr in klass.__dict__.get('__slots__', ())
+                          if attr != '_json')
+        fields = FIELDS[cls] = tuple(fields)
+    return fields
 
 
 class Base():
     """ Base class
     """
 
+    # Timestamps are stored as UTC epoch seconds, see created_at/updated_at
+    # `_json` caches the JSON strings, public and for serialization, until
+    # an attribute is assigned
+    __slots__ = ('id', '_created_at', '_updated_at', '_json')
+
+    # Attributes with a secondary index used by search()
+    _indexes = ()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
-        s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+        storage.setup(self.__class__)
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self._created_at = _to_epoch(kwargs.get('created_at'))
         else:
-            self.created_at = datetime.utcnow()
+            self._created_at = int(time.time())
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self._updated_at = _to_epoch(kwargs.get('updated_at'))
         else:
-            self.updated_at = datetime.utcnow()
+            self._updated_at = self._created_at
+
+    def __setattr__(self, name: str, value):
+        """ Assign an attribute and drop the cached JSON strings
+        """
+        _setattr(self, name, value)
+        if name != '_json':
+            _setattr(self, '_json', None)
+
+    @property
+    def created_at(self) -> datetime:
+        """ Getter of the creation date (naive UTC)
+        """
+        if self._created_at is None:
+            return None
+        return EPOCH + timedelta(seconds=self._created_at)
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        """ Setter of the creation date
+        """
+        self._created_at = _to_epoch(value)
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Getter of the last update date (naive UTC)
+        """
+        if self._updated_at is None:
+            return None
+        return EPOCH + timedelta(seconds=self._updated_at)
+
+    @updated_at.setter
+    def updated_at(self, value: datetime):
+        """ Setter of the last update date
+        """
+        self._updated_at = _to_epoch(value)
 
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
@@ -45,10 +145,50 @@ class Base():
         return (self.id == other.id)
 
     def to_json(self, for_serialization: bool = False) -> dict:
-        """ Convert the object a JSON dictionary
+        """ Convert the object a JSON dictionary, decoded from the cached
+        JSON string when there is one
+        """
+        cache = getattr(self, '_json', None)
+        if cache is not None:
+            value = cache[1 if for_serialization else 0]
+            if value is not None:
+                return json.loads(value)
+        return self._to_json(for_serialization)
+
+    def to_json_string(self, for_serialization: bool = False) -> str:
+        """ Convert the object to a JSON string, with sorted keys, cached
+        until the next assignment
+        """
+        cache = getattr(self, '_json', None)
+        if cache is None:
+            cache = [None, None]
+            _setattr(self, '_json', cache)
+        i = 1 if for_serialization else 0
+        value = cache[i]
+        if value is None:
+            value = cache[i] = ENCODER.encode(
+                self._to_json(for_serialization))
+        return value
+
+    def _to_json(self, for_serialization: bool) -> dict:
+        """ Build the JSON dictionary of the object
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key in _fields(self.__class__):
+            try:
+                value = getattr(self, key)
+            except AttributeError:
+                continue
+            if key in ('_created_at', '_updated_at'):
+                key = key[1:]
+                if value is not None:
+                    value = time.strftime(TIMESTAMP_FORMAT,
+                                          time.gmtime(value))
+            elif not for_serialization and key[0] == '_':
+                continue
+            result[key] = value
+        # Attributes of subclasses without __slots__
+        for key, value in getattr(self, '__dict__', {}).items():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -61,52 +201,62 @@ class Base():
     def load_from_file(cls):
         """ Load all objects from file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
-
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        storage.load(cls)
+        _bump(cls)
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        storage.save_all(cls)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def flush(cls):
+        """ Persist the mutations not written yet
+        """
+        storage.flush(cls)
+
+    @classmethod
+    def compact(cls):
+        """ Reclaim the disk space used by past mutations
+        """
+        storage.compact(cls)
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        self._updated_at = int(time.time())
+        storage.save(self)
+        _bump(self.__class__, (self.id,))
+
+    @classmethod
+    def save_many(cls, objs: List[TypeVar('Base')]):
+        """ Save several objects at once
+        """
+        now = int(time.time())
+        for obj in objs:
+            obj._updated_at = now
+        storage.save_many(objs)
+        _bump(cls, [obj.id for obj in objs])
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        storage.remove(self)
+        _bump(self.__class__, (self.id,))
+
+    @classmethod
+    def remove_many(cls, objs: List[TypeVar('Base')]):
+        """ Remove several objects at once
+        """
+        storage.remove_many(objs)
+        _bump(cls, [obj.id for obj in objs])
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return storage.count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -114,24 +264,49 @@ class Base():
         """
         return cls.search()
 
+    @classmethod
+    def page(cls, limit: int,
+             cursor: str = None) -> Tuple[List[TypeVar('Base')], str]:
+        """ Return up to `limit` objects ordered by ID, starting after the
+        `cursor` ID, and the cursor of the next page (None if last page)
+        """
+        return storage.page(cls, limit, cursor)
+
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return storage.get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return storage.search(cls, attributes)
+
+    @classmethod
+    def explain(cls, attributes: dict = {}) -> str:
+        """ Describe how search() finds the objects matching `attributes`:
+        "index <attribute>" or "scan"
+        """
+        return storage.explain(cls, attributes)
+
+    @classmethod
+    def etag(cls, obj_id: str = None) -> str:
+        """ Entity tag of all objects, or of one object by ID: it changes
+        with every mutation, and on restart unless the storage keeps the
+        versions
+        """
+        version = storage.version(cls, obj_id)
+        if version is None:
+            s_class = cls.__name__
+            if obj_id is None:
+                version = CLASS_VERSIONS.get(s_class, 0)
+            else:
+                version = OBJECT_VERSIONS.get(s_class, {}).get(
+                    obj_id, LOAD_VERSIONS.get(s_class, 0))
+            version = "{}-{}".format(BOOT_ID, version)
+        if obj_id is None:
+            return version
+        # Never the tag of all objects, even for an ID that doesn't exist
+        return "{}-{}".format(version, obj_id)
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+""" Storage engines of the models
+"""
+from os import getenv
+
+
+storage = None
+storage_type = getenv("STORAGE_TYPE", "file")
+
+if storage_type == "sqlite":
+    from models.engine.db_storage import DBStorage
+
+    storage = DBStorage()
+else:
+    from models.engine.file_storage import FileStorage
+
+    storage = FileStorage()
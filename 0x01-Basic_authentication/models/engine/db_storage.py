@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+""" SQLite storage module: one table per class, with an indexed column
+for each attribute listed in the `_indexes` of the class
+"""
+from typing import TypeVar, List, Tuple
+from os import getenv, path
+from models.engine.storage import Storage
+import json
+import re
+import sqlite3
+import threading
+
+
+SQLITE_PATH = getenv("SQLITE_PATH", ".db.sqlite3")
+# Python types stored as such in the indexed columns
+COLUMN_TYPES = (str, int, float, type(None))
+
+
+def _column_value(value):
+    """ Value of an attribute in its indexed column, NULL if the type
+    can't be compared by SQLite the way Python does
+    """
+    if type(value) in COLUMN_TYPES:
+        return value
+    return None
+
+
+class DBStorage(Storage):
+    """ SQLite storage
+
+    Each object is stored as its serialized JSON in the `data` column.
+    search() filters on indexed columns in SQL, then checks every
+    attribute on the objects found.
+
+    Triggers count the mutations of each table in `_versions`, and copy
+    the count into the `_version` column of the rows they change: these
+    versions hold for every process sharing the database.
+    """
+
+    def __init__(self):
+        """ Initialize a DBStorage instance on SQLITE_PATH
+        """
+        self._connection = sqlite3.connect(SQLITE_PATH,
+                                           check_same_thread=False,
+                                           isolation_level=None)
+        self._lock = threading.Lock()
+        self._tables = set()
+
+    def _execute(self, sql: str, parameters: tuple = ()) -> list:
+        """ Run one statement and return all its rows
+        """
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _executemany(self, sql: str, rows: list):
+        """ Run one statement for each row in a single transaction
+        """
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.executemany(sql, rows)
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def setup(self, cls: type):
+        """ Create the table of a class and its indexes if needed
+        """
+        s_class = cls.__name__
+        if s_class in self._tables:
+            return
+        with self._lock:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS "{}" '
+                '(id TEXT PRIMARY KEY, data TEXT NOT NULL)'.format(s_class))
+            columns = [row[1] for row in self._connection.execute(
+                'PRAGMA table_info("{}")'.format(s_class))]
+            if '_version' not in columns:
+                self._connection.execute(
+                    'ALTER TABLE "{}" ADD COLUMN _version INTEGER '
+                    'NOT NULL DEFAULT 0'.format(s_class))
+            self._setup_versions(s_class)
+            for attr in cls._indexes:
+                if attr not in columns:
+                    self._connection.execute(
+                        'ALTER TABLE "{}" ADD COLUMN "{}"'.format(
+                            s_class, attr))
+                    self._connection.execute(
+                        'UPDATE "{0}" SET "{1}" = '
+                        'json_extract(data, \'$."{1}"\')'.format(
+                            s_class, attr))
+                self._connection.execute(
+                    'CREATE INDEX IF NOT EXISTS "{0}_{1}" '
+                    'ON "{0}" ("{1}")'.format(s_class, attr))
+            self._tables.add(s_class)
+
+    def _setup_versions(self, s_class: str):
+        """ Create the version counter of a table and its triggers if
+        needed; the random token keeps the versions of a previous database
+        from matching
+        """
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS _versions (name TEXT PRIMARY KEY, '
+            'token TEXT NOT NULL, version INTEGER NOT NULL)')
+        self._connection.execute(
+            'INSERT OR IGNORE INTO _versions '
+            'VALUES (?, lower(hex(randomblob(6))), 0)', (s_class,))
+        bump = 'UPDATE _versions SET version = version + 1 ' \
+            'WHERE name = \'{}\';'.format(s_class)
+        set_row = 'UPDATE "{0}" SET _version = (SELECT version FROM ' \
+            '_versions WHERE name = \'{0}\') WHERE id = NEW.id;'.format(
+                s_class)
+        for event, body in (('INSERT', bump + set_row),
+                            ('UPDATE OF data', bump + set_row),
+                            ('DELETE', bump)):
+            self._connection.execute(
+                'CREATE TRIGGER IF NOT EXISTS "{0}_version_{1}" '
+                'AFTER {2} ON "{0}" BEGIN {3} END'.format(
+                    s_class, event.split()[0].lower(), event, body))
+
+    def load(self, cls: type):
+        """ Prepare the table of a class, importing .db_<Class>.json
+        into it when the table is empty
+        """
+        self.setup(cls)
+        file_path = ".db_{}.json".format(cls.__name__)
+        if self.count(cls) > 0 or not path.exists(file_path):
+            return
+
+        with open(file_path, 'r') as f:
+            objs_json = json.load(f)
+        rows = [self._row(cls(**obj_json)) for obj_json in objs_json.values()]
+        self._executemany(self._insert_sql(cls), rows)
+
+    def save_all(self, cls: type):
+        """ Every mutation is already committed
+        """
+        pass
+
+    def _insert_sql(self, cls: type) -> str:
+        """ Upsert statement of a class
+        """
+        columns = ['"{}"'.format(c) for c in ['id', 'data'] + list(
+            cls._indexes)]
+        return 'INSERT INTO "{}" ({}) VALUES ({}) ' \
+            'ON CONFLICT (id) DO UPDATE SET {}'.format(
+                cls.__name__, ", ".join(columns),
+                ", ".join("?" for c in columns),
+                ", ".join("{0} = excluded.{0}".format(c)
+                          for c in columns[1:]))
+
+    def _row(self, obj: TypeVar('Base')) -> tuple:
+        """ Column values of an object
+        """
+        return (obj.id, obj.to_json_string(True)) + tuple(
+            _column_value(getattr(obj, attr, None))
+            for attr in obj.__class__._indexes)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update an object
+        """
+        cls = obj.__class__
+        self.setup(cls)
+        self._execute(self._insert_sql(cls), self._row(obj))
+
+    def save_many(self, objs: List[TypeVar('Base')]):
+        """ Insert or update several objects of one class in a single
+        transaction
+        """
+        if len(objs) == 0:
+            return
+        cls = objs[0].__class__
+        self.setup(cls)
+        self._executemany(self._insert_sql(cls),
+                          [self._row(obj) for obj in objs])
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete an object
+        """
+        self._execute('DELETE FROM "{}" WHERE id = ?'.format(
+            obj.__class__.__name__), (obj.id,))
+
+    def remove_many(self, objs: List[TypeVar('Base')]):
+        """ Delete several objects of one class in a single transaction
+        """
+        if len(objs) == 0:
+            return
+        self._executemany('DELETE FROM "{}" WHERE id = ?'.format(
+            objs[0].__class__.__name__), [(obj.id,) for obj in objs])
+
+    def count(self, cls: type) -> int:
+        """ Count all objects of a class
+        """
+        rows = self._execute('SELECT COUNT(*) FROM "{}"'.format(cls.__name__))
+        return rows[0][0]
+
+    def page(self, cls: type, limit: int,
+             cursor: str = None) -> Tuple[List[TypeVar('Base')], str]:
+        """ Return up to `limit` objects ordered by ID, starting after the
+        `cursor` ID, and the cursor of the next page (None if last page)
+        """
+        rows = self._execute(
+            'SELECT data FROM "{}" WHERE id > ? ORDER BY id LIMIT ?'.format(
+                cls.__name__), ("" if cursor is None else cursor, limit + 1))
+        objs = [cls(**json.loads(row[0])) for row in rows[:limit]]
+        next_cursor = objs[-1].id if len(rows) > limit else None
+        return objs, next_cursor
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        rows = self._execute('SELECT data FROM "{}" WHERE id = ?'.format(
+            cls.__name__), (obj_id,))
+        if len(rows) == 0:
+            return None
+        return cls(**json.loads(rows[0][0]))
+
+    def search(self, cls: type,
+               attributes: dict = {}) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+        """
+        def _search(obj):
+            if len(attributes) == 0:
+                return True
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        sql, parameters = self._search_sql(cls, attributes)
+        rows = self._execute(sql, parameters)
+        objs = [cls(**json.loads(row[0])) for row in rows]
+        return list(filter(_search, objs))
+
+    def _search_sql(self, cls: type, attributes: dict) -> Tuple[str, tuple]:
+        """ Query of search(), filtering on the ID and indexed columns
+        """
+        conditions = []
+        parameters = []
+        for attr, value in attributes.items():
+            if attr != 'id' and attr not in cls._indexes or \
+                    type(value) not in COLUMN_TYPES:
+                continue
+            if value is None:
+                conditions.append('"{}" IS NULL'.format(attr))
+            else:
+                conditions.append('"{}" = ?'.format(attr))
+                parameters.append(value)
+        sql = 'SELECT data FROM "{}"'.format(cls.__name__)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return sql + " ORDER BY rowid", tuple(parameters)
+
+    def version(self, cls: type, obj_id: str = None) -> str:
+        """ Version of all objects of a class, or of one object by ID (the
+        version of the class if it doesn't exist)
+        """
+        s_class = cls.__name__
+        self.setup(cls)
+        if obj_id is None:
+            rows = self._execute(
+                'SELECT token, version FROM _versions WHERE name = ?',
+                (s_class,))
+        else:
+            rows = self._execute(
+                'SELECT token, coalesce((SELECT _version FROM "{}" '
+                'WHERE id = ?), version) FROM _versions '
+                'WHERE name = ?'.format(s_class), (obj_id, s_class))
+        return "{}-{}".format(*rows[0])
+
+    def explain(self, cls: type, attributes: dict = {}) -> str:
+        """ Describe how search() finds the objects matching `attributes`,
+        as planned by SQLite
+        """
+        self.setup(cls)
+        sql, parameters = self._search_sql(cls, attributes)
+        for row in self._execute("EXPLAIN QUERY PLAN " + sql, parameters):
+            match = re.search(r"USING (?:COVERING )?INDEX \S+ \((\w+)",
+                              row[-1])
+            if match is not None:
+                return "index {}".format(match.group(1))
+        return "scan"
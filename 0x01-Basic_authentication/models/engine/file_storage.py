@@ -0,0 +1,670 @@
+#!/usr/bin/env python3
+""" File storage module: objects live in memory and are persisted in
+.db_<Class>.json (or .db_<Class>.bin)
+"""
+from bisect import bisect_right, insort
+from contextlib import contextmanager
+from typing import TypeVar, List, Iterable, Tuple
+from os import getenv, path, remove, replace, truncate
+from models.engine.snapshot import Snapshot, write_snapshot
+from models.engine.storage import Storage
+import atexit
+import json
+import threading
+import time
+
+
+def _getenv_int(name: str, default: int) -> int:
+    """ Read an integer setting from the environment
+    """
+    try:
+        return int(getenv(name, default))
+    except ValueError:
+        return default
+
+
+TIMESTAMP_ATTRIBUTES = ('created_at', 'updated_at')
+# "snapshot" rewrites .db_<Class>.json on every mutation, "journal"
+# appends to .db_<Class>.journal and compacts past JOURNAL_MAX_SIZE bytes
+STORAGE_MODE = getenv("STORAGE_MODE", "snapshot")
+JOURNAL_MAX_SIZE = _getenv_int("JOURNAL_MAX_SIZE", 16 * 1024 * 1024)
+# Write-behind: when WRITE_BEHIND_WINDOW (seconds) is set, mutations are
+# persisted by a background thread, at most WRITE_BEHIND_MAX per write
+try:
+    WRITE_BEHIND_WINDOW = float(getenv("WRITE_BEHIND_WINDOW", 0))
+except ValueError:
+    WRITE_BEHIND_WINDOW = 0
+WRITE_BEHIND_MAX = _getenv_int("WRITE_BEHIND_MAX", 1000)
+# Lazy hydration: keep loaded records as raw dictionaries until an
+# object is actually returned by get(), search() or all()
+LAZY_LOAD = getenv("LAZY_LOAD", "0") == "1"
+# "json" snapshots are .db_<Class>.json, "binary" ones .db_<Class>.bin
+# (see models/engine/snapshot.py), loaded without decoding their records
+SNAPSHOT_FORMAT = getenv("SNAPSHOT_FORMAT", "json")
+
+
+def _save_record(obj: TypeVar('Base')) -> str:
+    """ Journal record of saving an object, reusing its serialized JSON
+    """
+    return '{{"op": "save", "id": {}, "obj": {}}}'.format(
+        json.dumps(obj.id), obj.to_json_string(True))
+
+
+def _remove_record(obj: TypeVar('Base')) -> str:
+    """ Journal record of removing an object
+    """
+    return json.dumps({'op': 'remove', 'id': obj.id})
+
+
+class RWLock():
+    """ Readers-writer lock: shared reads, exclusive writes. Waiting
+    writers go first, and neither side is reentrant.
+    """
+
+    def __init__(self):
+        """ Initialize a RWLock instance
+        """
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        """ Hold the lock shared
+        """
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """ Hold the lock exclusively
+        """
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class FileStorage(Storage):
+    """ In-memory storage persisted in JSON files
+
+    Objects of each class are kept in `data[<Class>]` by ID, as
+    instances, raw dictionaries (LAZY_LOAD) or offsets of records in
+    `snapshots[<Class>]` (binary snapshots), along with secondary
+    indexes on the attributes listed in the `_indexes` of the class.
+    `lock` guards them: get()/search()/page() and snapshots hold it
+    shared, save()/remove()/load() exclusively.
+    """
+
+    def __init__(self):
+        """ Initialize an empty FileStorage instance
+        """
+        self.data = {}
+        self.indexes = {}
+        self.index_keys = {}
+        # IDs of each class in sorted order for pagination, built on demand
+        self.sorted_ids = {}
+        self.snapshots = {}
+        # Mutations waiting to be persisted, by class, in the order they
+        # were applied to `data`
+        self.pending = {}
+        self.lock = RWLock()
+        self._pending_cond = threading.Condition()
+        self._write_lock = threading.RLock()
+        self._hydrate_lock = threading.Lock()
+        self._setup_lock = threading.Lock()
+        self._flusher = None
+        atexit.register(self.flush_all)
+
+    def setup(self, cls: type):
+        """ Create the (empty) store of a class on first use
+        """
+        s_class = cls.__name__
+        if self.data.get(s_class) is None:
+            with self._setup_lock:
+                if self.data.get(s_class) is None:
+                    self._reset_indexes(cls)
+                    self.data[s_class] = {}
+
+    def load(self, cls: type):
+        """ Load all objects from file, then replay the journal, holding
+        `_write_lock` so that nothing is appended to it meanwhile
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        snapshot_path = ".db_{}.bin".format(s_class)
+        with self._write_lock:
+            self.flush(cls)
+            snapshot = None
+            objs_json = {}
+            if SNAPSHOT_FORMAT == 'binary' and path.exists(snapshot_path):
+                snapshot = Snapshot(snapshot_path)
+            elif path.exists(file_path):
+                with open(file_path, 'r') as f:
+                    objs_json = json.load(f)
+
+            with self.lock.write():
+                self.data[s_class] = {}
+                self._reset_indexes(cls)
+                if snapshot is not None:
+                    self._load_snapshot(cls, snapshot)
+                for obj_id, obj_json in objs_json.items():
+                    self.data[s_class][obj_id] = self._load(cls, obj_json)
+                    self._index(cls, self.data[s_class][obj_id])
+                self._replay_journal(cls)
+
+    def _load_snapshot(self, cls: type, snapshot: Snapshot):
+        """ Store the record offsets of a binary snapshot and index them
+        from its keys table
+        """
+        s_class = cls.__name__
+        ids, offsets, keys = snapshot.table()
+        self.snapshots[s_class] = snapshot
+        self.data[s_class] = dict(zip(ids, offsets))
+        columns = []
+        for attr in cls._indexes:
+            values = keys.get(attr)
+            if values is None:
+                # Attribute indexed after the snapshot was written
+                values = [snapshot.record(offset).get(attr)
+                          for offset in offsets]
+            columns.append(values)
+            buckets = self.indexes[s_class][attr]
+            for obj_id, key in zip(ids, values):
+                try:
+                    buckets.setdefault(key, {})[obj_id] = None
+                except TypeError:
+                    continue
+        if columns:
+            self.index_keys[s_class] = dict(zip(ids, zip(*columns)))
+        else:
+            self.index_keys[s_class] = dict.fromkeys(ids, ())
+
+    def save_all(self, cls: type):
+        """ Save all objects to file
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        if SNAPSHOT_FORMAT == 'binary':
+            file_path = ".db_{}.bin".format(s_class)
+        # Only the references are copied under the lock, so that readers
+        # don't wait for the serialization: stored instances are replaced,
+        # never changed, and snapshots are read-only
+        with self.lock.read():
+            objs = dict(self.data[s_class])
+            keys = dict(self.index_keys[s_class])
+            snapshot = self.snapshots.get(s_class)
+        objs_json = {}
+        for obj_id, obj in objs.items():
+            if type(obj) is int:
+                objs_json[obj_id] = snapshot.raw(obj)
+            elif type(obj) is dict:
+                objs_json[obj_id] = obj
+            else:
+                objs_json[obj_id] = obj.to_json_string(True)
+
+        tmp_path = "{}.tmp".format(file_path)
+        if SNAPSHOT_FORMAT == 'binary':
+            for obj_id, obj_json in objs_json.items():
+                if type(obj_json) is str:
+                    objs_json[obj_id] = obj_json.encode('utf-8')
+            write_snapshot(tmp_path, objs_json, cls._indexes, keys)
+        else:
+            with open(tmp_path, 'w') as f:
+                f.write("{")
+                separator = ""
+                for obj_id, obj_json in objs_json.items():
+                    if type(obj_json) is bytes:
+                        obj_json = obj_json.decode('utf-8')
+                    elif type(obj_json) is dict:
+                        obj_json = json.dumps(obj_json)
+                    f.write("{}{}: {}".format(separator, json.dumps(obj_id),
+                                              obj_json))
+                    separator = ", "
+                f.write("}")
+        replace(tmp_path, file_path)
+
+    def _load(self, cls: type, obj_json: dict):
+        """ Build the stored form of a record read from disk: an instance,
+        or the raw dictionary itself in LAZY_LOAD mode
+        """
+        if LAZY_LOAD:
+            return obj_json
+        return cls(**obj_json)
+
+    def _hydrate(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return the object stored under `obj_id`, building the instance
+        of a raw record and keeping it for the next lookups
+        """
+        s_class = cls.__name__
+        obj = self.data[s_class].get(obj_id)
+        if type(obj) is int:
+            instance = cls(**self.snapshots[s_class].record(obj))
+        elif type(obj) is dict:
+            instance = cls(**obj)
+        else:
+            return obj
+        with self._hydrate_lock:
+            current = self.data[s_class].get(obj_id)
+            if current is not obj:
+                # Hydrated (or replaced) concurrently
+                return current
+            self.data[s_class][obj_id] = instance
+        return instance
+
+    def _replay_journal(self, cls: type):
+        """ Apply the journal records on top of the loaded snapshot
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        if not path.exists(journal_path):
+            return
+
+        end = 0
+        with open(journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last record of an interrupted append: cut it
+                    # off, so that the next append starts a new line
+                    truncate(journal_path, end)
+                    break
+                end += len(line)
+                obj_id = record.get('id')
+                if record.get('op') == 'save':
+                    obj = self._load(cls, record.get('obj'))
+                    self.data[s_class][obj_id] = obj
+                    self._index(cls, obj)
+                elif record.get('op') == 'remove':
+                    self.data[s_class].pop(obj_id, None)
+                    self._unindex(cls, obj_id)
+
+    def compact(self, cls: type):
+        """ Fold the journal into a new snapshot file, holding
+        `_write_lock` so that no record is appended to the journal
+        between the snapshot and its removal
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        with self._write_lock:
+            self.save_all(cls)
+            if path.exists(journal_path):
+                remove(journal_path)
+
+    def _queue(self, cls: type, record: str):
+        """ Queue the journal record of one mutation for persistence, under
+        `lock` so that the queue keeps the order in which mutations were
+        applied
+        """
+        with self._pending_cond:
+            self.pending.setdefault(cls, []).append(record)
+            if WRITE_BEHIND_WINDOW <= 0:
+                return
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop,
+                                                 daemon=True)
+                self._flusher.start()
+            self._pending_cond.notify()
+
+    def _persist(self, cls: type):
+        """ Write the queued mutations now, unless write-behind is on
+        """
+        if WRITE_BEHIND_WINDOW <= 0:
+            self.flush(cls)
+
+    def _flush_loop(self):
+        """ Write-behind flusher: coalesce mutations over
+        WRITE_BEHIND_WINDOW
+        """
+        while True:
+            with self._pending_cond:
+                while not self.pending:
+                    self._pending_cond.wait()
+                deadline = time.monotonic() + WRITE_BEHIND_WINDOW
+                while sum(map(len, self.pending.values())) \
+                        < WRITE_BEHIND_MAX:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._pending_cond.wait(remaining)
+            try:
+                self.flush_all()
+            except Exception:
+                # Mutations are re-queued, retry on the next window
+                time.sleep(WRITE_BEHIND_WINDOW)
+
+    def flush(self, cls: type):
+        """ Persist the queued mutations of a class
+        """
+        with self._write_lock:
+            with self._pending_cond:
+                records = self.pending.pop(cls, None)
+            if not records:
+                return
+            try:
+                self._write(cls, records)
+            except Exception:
+                with self._pending_cond:
+                    self.pending[cls] = records + self.pending.get(cls, [])
+                raise
+
+    def flush_all(self):
+        """ Persist the queued mutations of every class
+        """
+        with self._write_lock:
+            for cls in list(self.pending):
+                self.flush(cls)
+
+    def _write(self, cls: type, records: List[str]):
+        """ Persist mutations according to STORAGE_MODE
+        """
+        if STORAGE_MODE != 'journal':
+            self.compact(cls)
+            return
+
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        with open(journal_path, 'a') as f:
+            f.write("".join(r + "\n" for r in records))
+            journal_size = f.tell()
+        if journal_size > JOURNAL_MAX_SIZE:
+            self.compact(cls)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update an object
+        """
+        cls = obj.__class__
+        s_class = cls.__name__
+        with self.lock.write():
+            self.data[s_class][obj.id] = obj
+            self._index(cls, obj)
+            self._queue(cls, _save_record(obj))
+        self._persist(cls)
+
+    def save_many(self, objs: List[TypeVar('Base')]):
+        """ Insert or update several objects of one class, persisted in a
+        single write. If the write fails, the objects are taken back out
+        of the store and the exception is raised.
+        """
+        if len(objs) == 0:
+            return
+        cls = objs[0].__class__
+        s_class = cls.__name__
+        records = []
+        with self.lock.write():
+            previous = {obj.id: self.data[s_class].get(obj.id)
+                        for obj in objs}
+            for obj in objs:
+                self.data[s_class][obj.id] = obj
+                self._index(cls, obj)
+                records.append(_save_record(obj))
+                self._queue(cls, records[-1])
+        current = {obj.id: obj for obj in objs}
+        self._persist_many(cls, records, previous, current)
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete an object
+        """
+        cls = obj.__class__
+        s_class = cls.__name__
+        with self.lock.write():
+            if self.data[s_class].get(obj.id) is None:
+                return
+            del self.data[s_class][obj.id]
+            self._unindex(cls, obj.id)
+            self._queue(cls, _remove_record(obj))
+        self._persist(cls)
+
+    def remove_many(self, objs: List[TypeVar('Base')]):
+        """ Delete several objects of one class, persisted in a single
+        write. If the write fails, the objects are put back in the store
+        and the exception is raised.
+        """
+        if len(objs) == 0:
+            return
+        cls = objs[0].__class__
+        s_class = cls.__name__
+        records = []
+        previous = {}
+        with self.lock.write():
+            for obj in objs:
+                if self.data[s_class].get(obj.id) is None:
+                    continue
+                previous[obj.id] = self.data[s_class].pop(obj.id)
+                self._unindex(cls, obj.id)
+                records.append(_remove_record(obj))
+                self._queue(cls, records[-1])
+        current = dict.fromkeys(previous)
+        self._persist_many(cls, records, previous, current)
+
+    def _persist_many(self, cls: type, records: List[str], previous: dict,
+                      current: dict):
+        """ Write the queued mutations of a batch, or undo the batch if
+        the write fails: its `records` are dropped from the queue and the
+        objects it changed from `previous` to `current` (None if removed)
+        are restored, unless they have been changed again since then.
+        `_write_lock` is held so that no other flush writes the records
+        between the failure and the undo.
+        """
+        s_class = cls.__name__
+        with self._write_lock:
+            try:
+                self._persist(cls)
+            except Exception:
+                dropped = set(map(id, records))
+                with self.lock.write():
+                    with self._pending_cond:
+                        self.pending[cls] = [
+                            r for r in self.pending.get(cls, [])
+                            if id(r) not in dropped]
+                        if not self.pending[cls]:
+                            del self.pending[cls]
+                    for obj_id, obj in previous.items():
+                        if self.data[s_class].get(obj_id) is not \
+                                current[obj_id]:
+                            continue
+                        if obj is None:
+                            del self.data[s_class][obj_id]
+                            self._unindex(cls, obj_id)
+                            continue
+                        self.data[s_class][obj_id] = obj
+                        if type(obj) is int:
+                            obj = self.snapshots[s_class].record(obj)
+                        self._index(cls, obj)
+                raise
+
+    def count(self, cls: type) -> int:
+        """ Count all objects of a class
+        """
+        s_class = cls.__name__
+        return len(self.data[s_class].keys())
+
+    def page(self, cls: type, limit: int,
+             cursor: str = None) -> Tuple[List[TypeVar('Base')], str]:
+        """ Return up to `limit` objects ordered by ID, starting after the
+        `cursor` ID, and the cursor of the next page (None if last page)
+        """
+        s_class = cls.__name__
+        with self.lock.read():
+            sorted_ids = self.sorted_ids.get(s_class)
+            if sorted_ids is None:
+                sorted_ids = sorted(self.data[s_class])
+                self.sorted_ids[s_class] = sorted_ids
+            start = 0 if cursor is None else bisect_right(sorted_ids, cursor)
+            obj_ids = sorted_ids[start:start + limit]
+            next_cursor = None
+            if obj_ids and start + limit < len(sorted_ids):
+                next_cursor = obj_ids[-1]
+            objs = [self._hydrate(cls, obj_id) for obj_id in obj_ids]
+        return [obj for obj in objs if obj is not None], next_cursor
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        with self.lock.read():
+            return self._hydrate(cls, obj_id)
+
+    def search(self, cls: type,
+               attributes: dict = {}) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+        """
+        s_class = cls.__name__
+
+        def _search(obj):
+            if len(attributes) == 0:
+                return True
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        def _raw_search(obj_json):
+            for k, v in attributes.items():
+                if k in obj_json and k not in TIMESTAMP_ATTRIBUTES \
+                        and obj_json[k] != v:
+                    return False
+            return True
+
+        result = []
+        with self.lock.read():
+            obj_ids = self._index_lookup(cls, attributes)
+            if obj_ids is None:
+                obj_ids = list(self.data[s_class])
+            for obj_id in obj_ids:
+                obj = self.data[s_class].get(obj_id)
+                if type(obj) is int:
+                    obj = self.snapshots[s_class].record(obj)
+                if type(obj) is dict:
+                    if not _raw_search(obj):
+                        continue
+                    obj = self._hydrate(cls, obj_id)
+                if obj is not None and _search(obj):
+                    result.append(obj)
+        return result
+
+    def _reset_indexes(self, cls: type):
+        """ Drop and recreate the (empty) indexes of a class
+        """
+        s_class = cls.__name__
+        self.indexes[s_class] = {attr: {} for attr in cls._indexes}
+        self.index_keys[s_class] = {}
+        self.sorted_ids.pop(s_class, None)
+
+    def _index(self, cls: type, obj: TypeVar('Base')):
+        """ Add or refresh an object in the class indexes
+        """
+        s_class = cls.__name__
+        if type(obj) is dict:
+            obj_id = obj.get('id')
+            keys = tuple(obj.get(attr) for attr in cls._indexes)
+        else:
+            obj_id = obj.id
+            keys = tuple(getattr(obj, attr, None) for attr in cls._indexes)
+        old_keys = self.index_keys[s_class].get(obj_id)
+        if old_keys is None and self.sorted_ids.get(s_class) is not None:
+            insort(self.sorted_ids[s_class], obj_id)
+        if old_keys == keys:
+            return
+        if old_keys is not None:
+            self._drop_index_keys(cls, obj_id, old_keys)
+        for attr, key in zip(cls._indexes, keys):
+            try:
+                self.indexes[s_class][attr].setdefault(key, {})[obj_id] = None
+            except TypeError:
+                continue
+        self.index_keys[s_class][obj_id] = keys
+
+    def _unindex(self, cls: type, obj_id: str):
+        """ Remove an object from the class indexes
+        """
+        s_class = cls.__name__
+        keys = self.index_keys[s_class].pop(obj_id, None)
+        if keys is None:
+            return
+        sorted_ids = self.sorted_ids.get(s_class)
+        if sorted_ids is not None:
+            i = bisect_right(sorted_ids, obj_id) - 1
+            if i >= 0 and sorted_ids[i] == obj_id:
+                del sorted_ids[i]
+        self._drop_index_keys(cls, obj_id, keys)
+
+    def _drop_index_keys(self, cls: type, obj_id: str, keys: tuple):
+        """ Remove an object from the index buckets of `keys`
+        """
+        s_class = cls.__name__
+        for attr, key in zip(cls._indexes, keys):
+            try:
+                bucket = self.indexes[s_class][attr].get(key)
+            except TypeError:
+                continue
+            if bucket is None:
+                continue
+            bucket.pop(obj_id, None)
+            if len(bucket) == 0:
+                del self.indexes[s_class][attr][key]
+
+    def _plan(self, cls: type, attributes: dict) -> Tuple[str, dict]:
+        """ Choose the most selective index for `attributes`: the ID
+        itself, or the smallest matching index bucket
+        Return:
+          - the attribute of the index, None if no index applies
+          - the IDs of its bucket
+        """
+        s_class = cls.__name__
+        if 'id' in attributes:
+            obj_id = attributes['id']
+            try:
+                found = obj_id in self.data[s_class]
+            except TypeError:
+                found = False
+            return 'id', {obj_id: None} if found else {}
+        best_attr, best = None, None
+        for attr, value in attributes.items():
+            if attr not in cls._indexes:
+                continue
+            try:
+                bucket = self.indexes[s_class][attr].get(value, {})
+            except TypeError:
+                continue
+            if best is None or len(bucket) < len(best):
+                best_attr, best = attr, bucket
+        return best_attr, best
+
+    def _index_lookup(self, cls: type, attributes: dict) -> Iterable[str]:
+        """ Return the IDs of the most selective index bucket matching
+        `attributes`, or None if no index applies
+        """
+        attr, bucket = self._plan(cls, attributes)
+        if attr is None:
+            return None
+        return list(bucket)
+
+    def explain(self, cls: type, attributes: dict = {}) -> str:
+        """ Describe how search() finds the objects matching `attributes`
+        """
+        with self.lock.read():
+            attr, bucket = self._plan(cls, attributes)
+        if attr is None:
+            return "scan"
+        return "index {}".format(attr)
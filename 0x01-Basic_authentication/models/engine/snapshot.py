@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+""" Binary snapshot module
+
+A snapshot holds the serialized objects of one class:
+
+- header: magic, version, object count and the offsets of the tables
+- records: one per object, a 4-byte length followed by its JSON
+- offsets table: the 8-byte offset of each record
+- IDs table: a JSON array of the IDs, in the order of the offsets
+- keys table: a JSON object giving, for each indexed attribute, the
+  array of its values in the same order
+
+Opening a snapshot only reads its tables: records are decoded one at a
+time, from a read-only memory map.
+
+Usage: ./models/engine/snapshot.py <source> <destination> [attr...]
+converts .db_<Class>.json to .db_<Class>.bin, storing the values of the
+given indexed attributes, or back when the destination ends in .json.
+"""
+from array import array
+from typing import Iterable, List, Tuple
+import json
+import mmap
+import struct
+import sys
+
+
+MAGIC = b"BDB\0"
+VERSION = 1
+# magic, version, count, offsets table, IDs table, keys table
+HEADER = struct.Struct("<4sHxxQQQQ")
+LENGTH = struct.Struct("<I")
+
+
+class Snapshot():
+    """ Read-only binary snapshot
+    """
+
+    def __init__(self, file_path: str):
+        """ Map a snapshot file and check its header
+        """
+        with open(file_path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self._offsets_at, self._ids_at, \
+            self._keys_at = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a snapshot".format(file_path))
+
+    def _blob(self, offset: int) -> bytes:
+        """ Return the length-prefixed bytes at `offset`
+        """
+        length, = LENGTH.unpack_from(self._map, offset)
+        start = offset + LENGTH.size
+        return self._map[start:start + length]
+
+    def table(self) -> Tuple[List[str], array, dict]:
+        """ Return the IDs, the offsets of their records and the values
+        of the indexed attributes
+        """
+        offsets = array('Q')
+        offsets.frombytes(self._map[self._offsets_at:
+                                    self._offsets_at + 8 * self.count])
+        ids = json.loads(self._blob(self._ids_at))
+        keys = json.loads(self._blob(self._keys_at))
+        return ids, offsets, keys
+
+    def raw(self, offset: int) -> bytes:
+        """ Return the JSON of the record at `offset`
+        """
+        return self._blob(offset)
+
+    def record(self, offset: int) -> dict:
+        """ Return the decoded record at `offset`
+        """
+        return json.loads(self._blob(offset))
+
+    def records(self) -> Iterable[Tuple[str, dict]]:
+        """ Iterate over all (ID, record) pairs
+        """
+        ids, offsets, keys = self.table()
+        for obj_id, offset in zip(ids, offsets):
+            yield obj_id, self.record(offset)
+
+
+def write_snapshot(file_path: str, objs_json: dict,
+                   attributes: tuple = (), keys: dict = None):
+    """ Write a snapshot of `objs_json`, the records by ID as dictionaries
+    or JSON bytes. `keys` gives the values of the indexed `attributes`
+    by ID, read from the records when missing.
+    """
+    ids = []
+    offsets = array('Q')
+    values = {attr: [] for attr in attributes}
+    with open(file_path, 'wb') as f:
+        f.write(b"\0" * HEADER.size)
+        for obj_id, obj_json in objs_json.items():
+            if keys is not None:
+                obj_keys = keys[obj_id]
+            else:
+                obj_keys = tuple(obj_json.get(attr) for attr in attributes)
+            if type(obj_json) is not bytes:
+                obj_json = json.dumps(obj_json).encode('utf-8')
+            ids.append(obj_id)
+            offsets.append(f.tell())
+            for attr, key in zip(attributes, obj_keys):
+                values[attr].append(key)
+            f.write(LENGTH.pack(len(obj_json)))
+            f.write(obj_json)
+
+        offsets_at = f.tell()
+        f.write(offsets.tobytes())
+        ids_at = f.tell()
+        blob = json.dumps(ids).encode('utf-8')
+        f.write(LENGTH.pack(len(blob)) + blob)
+        keys_at = f.tell()
+        blob = json.dumps(values).encode('utf-8')
+        f.write(LENGTH.pack(len(blob)) + blob)
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(ids), offsets_at, ids_at,
+                            keys_at))
+
+
+def json_to_snapshot(json_path: str, snapshot_path: str,
+                     attributes: tuple = ()):
+    """ Convert a .db_<Class>.json file to a snapshot
+    """
+    with open(json_path, 'r') as f:
+        objs_json = json.load(f)
+    write_snapshot(snapshot_path, objs_json, attributes)
+
+
+def snapshot_to_json(snapshot_path: str, json_path: str):
+    """ Convert a snapshot to a .db_<Class>.json file
+    """
+    objs_json = dict(Snapshot(snapshot_path).records())
+    with open(json_path, 'w') as f:
+        json.dump(objs_json, f)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: {} <source> <destination> [attr...]".format(
+            sys.argv[0]))
+        sys.exit(1)
+    source, destination = sys.argv[1:3]
+    if destination.endswith(".json"):
+        snapshot_to_json(source, destination)
+    else:
+        json_to_snapshot(source, destination, tuple(sys.argv[3:]))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+""" Storage module
+"""
+from abc import ABC, abstractmethod
+from typing import TypeVar, List, Tuple
+
+
+class Storage(ABC):
+    """ Storage engine interface: persistence and lookup of the
+    objects of each model class. An engine must implement the abstract
+    methods to be instantiated.
+    """
+
+    def setup(self, cls: type):
+        """ Prepare the storage of a model class
+        """
+        pass
+
+    @abstractmethod
+    def load(self, cls: type):
+        """ Load all objects of a class from disk
+        """
+
+    @abstractmethod
+    def save_all(self, cls: type):
+        """ Write all objects of a class to disk
+        """
+
+    def flush(self, cls: type):
+        """ Persist the mutations of a class not written yet
+        """
+        pass
+
+    def compact(self, cls: type):
+        """ Reclaim the disk space of a class
+        """
+        pass
+
+    @abstractmethod
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update an object
+        """
+
+    def save_many(self, objs: List[TypeVar('Base')]):
+        """ Insert or update several objects of one class at once
+        """
+        for obj in objs:
+            self.save(obj)
+
+    @abstractmethod
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete an object
+        """
+
+    def remove_many(self, objs: List[TypeVar('Base')]):
+        """ Delete several objects of one class at once
+        """
+        for obj in objs:
+            self.remove(obj)
+
+    @abstractmethod
+    def count(self, cls: type) -> int:
+        """ Count all objects of a class
+        """
+
+    @abstractmethod
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+
+    @abstractmethod
+    def search(self, cls: type,
+               attributes: dict = {}) -> List[TypeVar('Base')]:
+        """ Return all objects with matching attributes
+        """
+
+    def explain(self, cls: type, attributes: dict = {}) -> str:
+        """ Describe how search() finds the objects matching `attributes`:
+        "index <attribute>" or "scan"
+        """
+        return "scan"
+
+    def version(self, cls: type, obj_id: str = None) -> str:
+        """ Version of all objects of a class, or of one object by ID,
+        kept by the storage itself: None if the engine keeps none
+        """
+        return None
+
+    @abstractmethod
+    def page(self, cls: type, limit: int,
+             cursor: str = None) -> Tuple[List[TypeVar('Base')], str]:
+        """ Return up to `limit` objects ordered by ID, starting after the
+        `cursor` ID, and the cursor of the next page (None if last page)
+        """
@@ -2,21 +2,34 @@
 """ User module
 """
 import hashlib
+import sys
 from models.base import Base
 
 
+def _intern(value):
+    """ Share one copy of repeated strings (first and last names)
+    """
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+
 class User(Base):
     """ User class
     """
 
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+
+    _indexes = ('email',)
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
         super().__init__(*args, **kwargs)
         self.email = kwargs.get('email')
         self._password = kwargs.get('_password')
-        self.first_name = kwargs.get('first_name')
-        self.last_name = kwargs.get('last_name')
+        self.first_name = _intern(kwargs.get('first_name'))
+        self.last_name = _intern(kwargs.get('last_name'))
 
     @property
     def password(self) -> str:
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+""" Multi-threaded stress test of the storage engines
+
+For each storage mode, writer threads save, update, and remove users
+(one at a time and in batches) while reader threads get, search, and page
+through them. Then the test checks:
+- no thread raised
+- the indexes match the store, and searches and pages find every user
+- a new process reloading the files gets the same data
+
+Each mode runs in its own process and temporary directory, since the
+settings are read at import.
+
+Usage: ./stress.py [seconds per mode] [mode...]  (default: 3, all modes)
+"""
+from os import environ, path
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+MODES = {
+    'snapshot': {},
+    'journal': {'STORAGE_MODE': 'journal', 'JOURNAL_MAX_SIZE': '20000'},
+    'write-behind': {'STORAGE_MODE': 'journal',
+                     'WRITE_BEHIND_WINDOW': '0.01'},
+    'lazy': {'LAZY_LOAD': '1'},
+    'binary': {'SNAPSHOT_FORMAT': 'binary'},
+    'sqlite': {'STORAGE_TYPE': 'sqlite'},
+}
+WRITERS = 4
+READERS = 4
+EMAILS = 50
+
+
+def dump() -> dict:
+    """ Serialized users of the store, by ID
+    """
+    from models.user import User
+    return {user.id: user.to_json(True) for user in User.all()}
+
+
+def writer(seed: int, stop: float, errors: list):
+    """ Save, update and remove random users until `stop`
+    """
+    from models.user import User
+    rand = random.Random(seed)
+    mine = [user for user in User.all() if hash(user.id) % WRITERS == seed]
+    while time.monotonic() < stop:
+        try:
+            op = rand.random()
+            if op < 0.4 or not mine:
+                user = User(email='e{}'.format(rand.randrange(EMAILS)))
+                user.password = 'pwd'
+                user.save()
+                mine.append(user)
+            elif op < 0.7:
+                # A copy, as stored instances are shared with the readers
+                i = rand.randrange(len(mine))
+                user = mine[i] = User(**mine[i].to_json(True))
+                user.email = 'e{}'.format(rand.randrange(EMAILS))
+                user.save()
+            elif op < 0.8:
+                users = [User(email='e{}'.format(rand.randrange(EMAILS)))
+                         for _ in range(5)]
+                User.save_many(users)
+                mine.extend(users)
+            elif op < 0.95:
+                mine.pop(rand.randrange(len(mine))).remove()
+            else:
+                users = [mine.pop(rand.randrange(len(mine)))
+                         for _ in range(min(3, len(mine)))]
+                User.remove_many(users)
+        except Exception as e:
+            errors.append(repr(e))
+
+
+def reader(seed: int, stop: float, errors: list):
+    """ Get, search and page through the users until `stop`
+    """
+    from models.user import User
+    rand = random.Random(seed)
+    while time.monotonic() < stop:
+        try:
+            email = 'e{}'.format(rand.randrange(EMAILS))
+            for user in User.search({'email': email}):
+                assert user.email == email, (user.email, email)
+                User.get(user.id)
+            users, cursor = User.page(10, None)
+            ids = [user.id for user in users]
+            assert ids == sorted(ids), ids
+            users = User.all()
+            assert len({user.id for user in users}) == len(users)
+        except Exception as e:
+            errors.append(repr(e))
+
+
+def check_indexes():
+    """ Check that the indexes, searches and pages match the store
+    """
+    from models.engine import storage
+    from models.user import User
+    if hasattr(storage, 'indexes'):
+        with storage.lock.read():
+            data = storage.data['User']
+            buckets = storage.indexes['User']['email']
+            for email, obj_ids in buckets.items():
+                for obj_id in obj_ids:
+                    assert User.get(obj_id).email == email, obj_id
+            assert sum(map(len, buckets.values())) == len(data)
+            sorted_ids = storage.sorted_ids.get('User')
+            assert sorted_ids is None or sorted_ids == sorted(data)
+
+    users = User.all()
+    assert User.count() == len(users)
+    for user in users:
+        assert user in User.search({'email': user.email}), user.id
+    paged, cursor = [], None
+    while True:
+        page, cursor = User.page(7, cursor)
+        paged.extend(user.id for user in page)
+        if cursor is None:
+            break
+    assert paged == sorted(user.id for user in users)
+
+
+def stress(seconds: float):
+    """ Run the threads on a reloaded store, check it and write the
+    expected data to expected.json
+    """
+    from models.user import User
+    User.load_from_file()
+    User.save_many([User(email='e{}'.format(i % EMAILS))
+                    for i in range(200)])
+    User.flush()
+    # Lazy and binary modes keep the reloaded users as raw records
+    User.load_from_file()
+
+    errors = []
+    stop = time.monotonic() + seconds
+    threads = [threading.Thread(target=writer, args=(i, stop, errors))
+               for i in range(WRITERS)] + \
+        [threading.Thread(target=reader, args=(i, stop, errors))
+         for i in range(READERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors[:5]
+
+    User.flush()
+    check_indexes()
+    with open('expected.json', 'w') as f:
+        json.dump(dump(), f)
+
+
+def run_mode(mode: str, seconds: float):
+    """ Stress one mode in a new directory, then reload it in another
+    process and compare
+    """
+    script = path.abspath(__file__)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(environ, **MODES[mode])
+        subprocess.run([sys.executable, script, '--stress', str(seconds)],
+                       cwd=tmp, env=env, check=True)
+        reloaded = subprocess.run([sys.executable, script, '--dump'],
+                                  cwd=tmp, env=env, check=True,
+                                  capture_output=True, text=True).stdout
+        with open(path.join(tmp, 'expected.json')) as f:
+            expected = json.load(f)
+        assert json.loads(reloaded) == expected, \
+            "{}: reloaded data differs".format(mode)
+        print("{}: ok, {} users".format(mode, len(expected)))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--stress']:
+        stress(float(sys.argv[2]))
+    elif sys.argv[1:2] == ['--dump']:
+        from models.user import User
+        User.load_from_file()
+        print(json.dumps(dump()))
+    else:
+        seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+        for mode in sys.argv[2:] or MODES:
+            run_mode(mode, seconds)
@@ -4,12 +4,24 @@ Flask application for user authentication.
 """
 
 from flask import Flask, jsonify, request, abort, redirect, make_response
-from auth import Auth
+from auth import Auth, HashingUnavailable
 
 AUTH = Auth()
 app = Flask(__name__)
 
 
+@app.errorhandler(HashingUnavailable)
+def hashing_unavailable(error) -> str:
+    """Reject the request while password hashing is saturated."""
+    return jsonify({"message": "service overloaded"}), 503
+
+
+@app.teardown_appcontext
+def teardown(exception) -> None:
+    """Release the database session of the request."""
+    AUTH.teardown()
+
+
 @app.route('/', methods=['GET'])
 def home() -> str:
     """Welcome route."""
@@ -37,9 +49,9 @@ def login() -> str:
     password = request.form.get('password')
     if not email or not password:
         abort(401)
-    if not AUTH.valid_login(email, password):
+    session_id = AUTH.login(email, password)
+    if session_id is None:
         abort(401)
-    session_id = AUTH.create_session(email)
     response = jsonify({"email": email, "message": "logged in"})
     response.set_cookie("session_id", session_id)
     return response
@@ -52,7 +64,7 @@ def logout() -> str:
     user = AUTH.get_user_from_session_id(session_id)
     if user is None:
         abort(403)
-    AUTH.destroy_session(user.id)
+    AUTH.destroy_session(user.id, session_id)
     return redirect('/')
 
 
@@ -66,5 +78,31 @@ def profile() -> str:
     return jsonify({"email": user.email}), 200
 
 
+@app.route('/reset_password', methods=['POST'])
+def get_reset_password_token() -> str:
+    """Generate a password reset token."""
+    email = request.form.get('email')
+    try:
+        reset_token = AUTH.get_reset_password_token(email)
+    except ValueError:
+        abort(403)
+    return jsonify({"email": email, "reset_token": reset_token}), 200
+
+
+@app.route('/reset_password', methods=['PUT'])
+def update_password() -> str:
+    """Update a password using a reset token."""
+    email = request.form.get('email')
+    reset_token = request.form.get('reset_token')
+    new_password = request.form.get('new_password')
+    if not new_password:
+        abort(400)
+    try:
+        AUTH.update_password(reset_token, new_password)
+    except ValueError:
+        abort(403)
+    return jsonify({"email": email, "message": "Password updated"}), 200
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
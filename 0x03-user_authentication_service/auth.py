@@ -4,71 +4,367 @@ Authentication logic for the application.
 """
 
 import bcrypt
+import multiprocessing
+import os
+import threading
+import time
 import uuid
-from db import DB
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import NoResultFound
+from db import DB, _getenv_number, _utcnow
 from user import User
 
 
+# bcrypt runs in a pool of BCRYPT_WORKERS processes (inline when 0), with
+# at most BCRYPT_MAX_PENDING hashes queued or running, each waited for at
+# most BCRYPT_TIMEOUT seconds
+BCRYPT_WORKERS = _getenv_number("BCRYPT_WORKERS", os.cpu_count() or 1)
+BCRYPT_MAX_PENDING = _getenv_number("BCRYPT_MAX_PENDING", 64)
+BCRYPT_TIMEOUT = _getenv_number("BCRYPT_TIMEOUT", 10.0, float)
+# Users by session ID are cached (LRU) for SESSION_CACHE_TTL seconds, which
+# bounds how long other processes may see a session after it was destroyed
+SESSION_CACHE_SIZE = _getenv_number("SESSION_CACHE_SIZE", 1024)
+SESSION_CACHE_TTL = _getenv_number("SESSION_CACHE_TTL", 60.0, float)
+# Sessions expire after SESSION_DURATION seconds (never when 0); expired
+# ones are deleted every SESSION_SWEEP_INTERVAL seconds (never when 0), by
+# batches of SESSION_SWEEP_BATCH
+SESSION_DURATION = _getenv_number("SESSION_DURATION", 86400)
+SESSION_SWEEP_INTERVAL = _getenv_number("SESSION_SWEEP_INTERVAL", 60.0, float)
+SESSION_SWEEP_BATCH = _getenv_number("SESSION_SWEEP_BATCH", 1000)
+
+
+class HashingUnavailable(Exception):
+    """Raised when the bcrypt pool is saturated or too slow."""
+
+
 def _hash_password(password: str) -> bytes:
     """Generate a hashed password."""
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
 
 
+def _check_password(password: str, hashed_password) -> bool:
+    """Check a password against its bcrypt hash."""
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode('utf-8')
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+
 def _generate_uuid() -> str:
     """Generate a new UUID as a string."""
     return str(uuid.uuid4())
 
 
+def _user_columns(user: User) -> dict:
+    """Return the column values of a user."""
+    return {column.name: getattr(user, column.name)
+            for column in User.__table__.columns}
+
+
 class Auth:
     """
     Auth class for managing user authentication.
     Methods:
         register_user: Register a new user.
         valid_login: Validate user login credentials.
-        create_session: Create a session for a user.
+        create_session: Create a new session for a user.
+        login: Validate credentials and create a session at once.
         get_user_from_session_id: Retrieve a user by session ID.
-        destroy_session: Log out a user by destroying their session.
+        destroy_session: Log out a user by destroying their session(s).
+        sweep_sessions: Delete the expired sessions.
+        get_reset_password_token: Generate a password reset token.
+        update_password: Update a password using a reset token.
+        teardown: Release the resources held for the current request.
+        cache_stats: Report the hit ratio of the session cache.
+    Users are cached by session ID (LRU, SESSION_CACHE_TTL seconds):
+    session changes write through the cache, password changes drop it.
+    A user can have several sessions, each expiring after
+    SESSION_DURATION seconds; a background thread deletes expired ones.
     """
     def __init__(self) -> None:
         """Initialize the Auth instance with a DB instance."""
+        self._pool = None
+        if BCRYPT_WORKERS > 0:
+            # Forked now, while this is the only thread: a fork copies the
+            # locks held by other threads, and a worker started later by
+            # spawn or a fork server would import __main__ (the app) again
+            self._pool = ProcessPoolExecutor(
+                BCRYPT_WORKERS, mp_context=multiprocessing.get_context("fork"))
+            self._pool.submit(int).result()
         self._db = DB()
+        self._pending = threading.BoundedSemaphore(max(BCRYPT_MAX_PENDING, 1))
+        self._cache = OrderedDict()
+        self._cache_sessions = {}
+        self._cache_lock = threading.Lock()
+        # Bumped by every invalidation, so that a lookup racing with one
+        # doesn't cache what it read before
+        self._cache_generation = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        if SESSION_DURATION > 0 and SESSION_SWEEP_INTERVAL > 0:
+            threading.Thread(target=self._sweep_loop, daemon=True).start()
+
+    def _bcrypt(self, func, *args):
+        """
+        Run a bcrypt function in the process pool, or inline without one.
+        Raises:
+            HashingUnavailable: If BCRYPT_MAX_PENDING hashes are pending,
+            or the result takes more than BCRYPT_TIMEOUT seconds.
+        """
+        pool = self._pool
+        if pool is None:
+            return func(*args)
+        if not self._pending.acquire(blocking=False):
+            raise HashingUnavailable("Too many pending hashes")
+        try:
+            future = pool.submit(func, *args)
+        except BrokenProcessPool:
+            self._pending.release()
+            self._pool = None
+            raise HashingUnavailable("Hashing process died")
+        except BaseException:
+            self._pending.release()
+            raise
+        # The slot is held until the hash is done, even after a timeout
+        future.add_done_callback(lambda f: self._pending.release())
+        try:
+            return future.result(timeout=BCRYPT_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            raise HashingUnavailable("Hashing timed out")
+        except BrokenProcessPool:
+            # Not forked again now that other threads run: the hashes run
+            # in the request threads from now on
+            self._pool = None
+            raise HashingUnavailable("Hashing process died")
+
+    def _cached_user(self, session_id: str) -> User:
+        """
+        Return a detached copy of the cached user of a session ID, or
+        None if not cached or expired.
+        """
+        with self._cache_lock:
+            entry = self._cache.get(session_id)
+            if entry is not None and time.monotonic() >= entry[1]:
+                self._drop_session(session_id)
+                entry = None
+            if entry is None:
+                self.cache_misses += 1
+                return None
+            self._cache.move_to_end(session_id)
+            self.cache_hits += 1
+        return User(**entry[0])
+
+    def _cache_user(self, session_id: str, columns: dict,
+                    generation: int = None,
+                    expires_at: datetime = None) -> None:
+        """
+        Cache the column values of the user of a session ID, read at
+        `generation` of the cache if given, until the session expires at
+        the latest.
+        """
+        if SESSION_CACHE_SIZE <= 0 or SESSION_CACHE_TTL <= 0:
+            return
+        with self._cache_lock:
+            if generation is not None and \
+                    generation != self._cache_generation:
+                return
+            self._drop_session(session_id)
+            ttl = SESSION_CACHE_TTL
+            if expires_at is not None:
+                ttl = min(ttl, (expires_at - _utcnow()).total_seconds())
+            self._cache[session_id] = (columns, time.monotonic() + ttl)
+            self._cache_sessions.setdefault(columns['id'],
+                                            set()).add(session_id)
+            while len(self._cache) > SESSION_CACHE_SIZE:
+                self._drop_session(next(iter(self._cache)))
+
+    def _uncache_user(self, user_id: int) -> None:
+        """Drop the cached sessions of a user."""
+        with self._cache_lock:
+            self._cache_generation += 1
+            for session_id in list(self._cache_sessions.get(user_id, ())):
+                self._drop_session(session_id)
+
+    def _drop_session(self, session_id: str) -> None:
+        """Drop a cached session, holding _cache_lock."""
+        entry = self._cache.pop(session_id, None)
+        if entry is None:
+            return
+        user_id = entry[0]['id']
+        sessions = self._cache_sessions.get(user_id)
+        sessions.discard(session_id)
+        if not sessions:
+            del self._cache_sessions[user_id]
+
+    def cache_stats(self) -> dict:
+        """Return the counters and hit ratio of the session cache."""
+        with self._cache_lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {'hits': self.cache_hits,
+                    'misses': self.cache_misses,
+                    'hit_ratio': self.cache_hits / lookups if lookups else 0,
+                    'size': len(self._cache)}
+
+    def _sweep_loop(self) -> None:
+        """Sweep the expired sessions every SESSION_SWEEP_INTERVAL."""
+        while True:
+            time.sleep(SESSION_SWEEP_INTERVAL)
+            try:
+                self.sweep_sessions()
+            except Exception:
+                # Retry on the next interval
+                pass
+
+    def sweep_sessions(self) -> int:
+        """
+        Delete the expired sessions, by batches of SESSION_SWEEP_BATCH
+        so that concurrent logins aren't blocked for long.
+        Returns:
+            int: The number of deleted sessions.
+        """
+        total = 0
+        try:
+            while True:
+                count = self._db.remove_expired_sessions(SESSION_SWEEP_BATCH)
+                total += count
+                if count < SESSION_SWEEP_BATCH:
+                    return total
+        finally:
+            self._db.close_session()
+
+    def teardown(self) -> None:
+        """Release the database session of the current request."""
+        self._db.close_session()
+
+    def _find_user_columns(self, **kwargs) -> dict:
+        """
+        Return the column values of the user found by kwargs, None if
+        none, then release the database session: the hash that follows
+        mustn't hold a connection, nor keep a transaction running.
+        """
+        try:
+            return _user_columns(self._db.find_user_by(**kwargs))
+        except NoResultFound:
+            return None
+        finally:
+            self._db.close_session()
 
     def register_user(self, email: str, password: str) -> User:
         """Register a new user with an email and password."""
-        try:
-            self._db.find_user_by(email=email)
+        if self._find_user_columns(email=email) is not None:
             raise ValueError(f"User {email} already exists")
-        except NoResultFound:
-            hashed_password = _hash_password(password)
+        hashed_password = self._bcrypt(_hash_password, password)
+        try:
             return self._db.add_user(email, hashed_password)
+        except IntegrityError:
+            # Registered by another thread since the lookup
+            raise ValueError(f"User {email} already exists")
 
     def valid_login(self, email: str, password: str) -> bool:
         """Validate user login credentials."""
-        try:
-            user = self._db.find_user_by(email=email)
-            return bcrypt.checkpw(password.encode('utf-8'), user.hashed_password.encode('utf-8'))
-        except NoResultFound:
+        columns = self._find_user_columns(email=email)
+        if columns is None:
             return False
+        return self._bcrypt(_check_password, password,
+                            columns['hashed_password'])
 
     def create_session(self, email: str) -> str:
-        """Create a session for a user."""
-        try:
-            user = self._db.find_user_by(email=email)
-            session_id = _generate_uuid()
-            self._db.update_user(user.id, session_id=session_id)
-            return session_id
-        except NoResultFound:
+        """Create a new session for a user, keeping their other ones."""
+        with self._db.transaction():
+            try:
+                user = self._db.find_user_by(email=email)
+            except NoResultFound:
+                return None
+            columns = _user_columns(user)
+            session_id, expires_at = self._add_session(columns['id'])
+        self._cache_user(session_id, columns, expires_at=expires_at)
+        return session_id
+
+    def login(self, email: str, password: str) -> str:
+        """
+        Validate user login credentials and create a new session, with a
+        single lookup.
+        Returns:
+            str: The session ID, None if the credentials are invalid.
+        """
+        columns = self._find_user_columns(email=email)
+        if columns is None or \
+                not self._bcrypt(_check_password, password,
+                                 columns['hashed_password']):
             return None
+        session_id, expires_at = self._add_session(columns['id'])
+        self._cache_user(session_id, columns, expires_at=expires_at)
+        return session_id
+
+    def _add_session(self, user_id: int) -> tuple:
+        """Add a new session of a user, returning its ID and expiry."""
+        session_id = _generate_uuid()
+        expires_at = None
+        if SESSION_DURATION > 0:
+            expires_at = _utcnow() + timedelta(seconds=SESSION_DURATION)
+        self._db.add_session(session_id, user_id, expires_at)
+        return session_id, expires_at
 
     def get_user_from_session_id(self, session_id: str) -> User:
         """Retrieve a user by their session ID."""
         if session_id is None:
             return None
+        user = self._cached_user(session_id)
+        if user is not None:
+            return user
+        generation = self._cache_generation
         try:
-            return self._db.find_user_by(session_id=session_id)
+            user_session = self._db.find_session(session_id)
         except NoResultFound:
             return None
+        user = user_session.user
+        self._cache_user(session_id, _user_columns(user), generation,
+                         user_session.expires_at)
+        return user
+
+    def destroy_session(self, user_id: int, session_id: str = None) -> None:
+        """Log out a user by destroying one session, or all of them."""
+        self._db.remove_sessions(user_id, session_id)
+        self._uncache_user(user_id)
+
+    def get_reset_password_token(self, email: str) -> str:
+        """
+        Generate a password reset token for a user.
+        Raises:
+            ValueError: If no user has this email.
+        """
+        with self._db.transaction():
+            try:
+                user = self._db.find_user_by(email=email)
+            except NoResultFound:
+                raise ValueError(f"User {email} not found")
+            reset_token = _generate_uuid()
+            if not self._db.update_user(user.id, reset_token=reset_token):
+                # Deleted since it was found
+                raise ValueError(f"User {email} not found")
+        return reset_token
 
-    def destroy_session(self, user_id: int) -> None:
-        """Log out a user by destroying their session."""
-        self._db.update_user(user_id, session_id=None)
+    def update_password(self, reset_token: str, password: str) -> None:
+        """
+        Update the password of the user holding a reset token.
+        Raises:
+            ValueError: If the reset token is invalid.
+        """
+        if reset_token is None:
+            raise ValueError("Invalid reset token")
+        columns = self._find_user_columns(reset_token=reset_token)
+        if columns is None:
+            raise ValueError("Invalid reset token")
+        user_id = columns['id']
+        hashed_password = self._bcrypt(_hash_password, password)
+        # Not updated if the token was used or replaced during the hash
+        if not self._db.update_user(user_id,
+                                    {'reset_token': reset_token},
+                                    hashed_password=hashed_password,
+                                    reset_token=None):
+            raise ValueError("Invalid reset token")
+        self._uncache_user(user_id)
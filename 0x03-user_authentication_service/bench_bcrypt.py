@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+""" Login throughput with bcrypt in the request threads and in the process
+pool, and the latency of GET /profile while the logins run
+
+Each mode runs the app in its own process (see bench_harness.py), with a
+small connection pool and without the session cache, so that each
+GET /profile needs a connection while the logins hash.
+
+Usage: ./bench_bcrypt.py [logins]  (default: 32)
+"""
+from os import cpu_count
+from bench_harness import run_modes, worker_args
+import http.client
+import sys
+import threading
+import time
+import urllib.parse
+
+
+MODES = {
+    'inline': {'BCRYPT_WORKERS': '0'},
+    'pool': {'BCRYPT_WORKERS': str(cpu_count() or 1)},
+}
+ENV = {'DB_POOL_SIZE': '2', 'DB_MAX_OVERFLOW': '0', 'SESSION_CACHE_SIZE': '0'}
+EMAIL = "bob@bob.com"
+PASSWORD = "mySuperPwd"
+
+
+def request(port: int, method: str, route: str, data: dict = None,
+            session_id: str = None) -> http.client.HTTPResponse:
+    """ Send a request to the app and return the (read) response
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {}
+    if session_id is not None:
+        headers["Cookie"] = "session_id={}".format(session_id)
+    body = None
+    if data is not None:
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+        body = urllib.parse.urlencode(data)
+    connection.request(method, route, body, headers)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response
+
+
+def run(logins: int):
+    """ Serve the app, run `logins` concurrent logins while polling
+    GET /profile, and print the results
+    """
+    from app import app
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    assert request(port, "POST", "/users",
+                   {"email": EMAIL, "password": PASSWORD}).status == 200
+    # A first login outside of the timing, whose session is polled
+    response = request(port, "POST", "/sessions",
+                       {"email": EMAIL, "password": PASSWORD})
+    assert response.status == 200
+    session_id = response.getheader("Set-Cookie").split(";")[0].split("=")[1]
+
+    latencies = []
+    statuses = []
+    done = threading.Event()
+
+    def poll():
+        while not done.is_set():
+            start = time.perf_counter()
+            status = request(port, "GET", "/profile",
+                             session_id=session_id).status
+            latencies.append(time.perf_counter() - start)
+            statuses.append(status)
+            time.sleep(0.01)
+
+    def login():
+        statuses.append(request(port, "POST", "/sessions",
+                                {"email": EMAIL,
+                                 "password": PASSWORD}).status)
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    threads = [threading.Thread(target=login) for _ in range(logins)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    done.set()
+    poller.join()
+    server.shutdown()
+    assert statuses == [200] * len(statuses), statuses
+
+    latencies.sort()
+    print("{:.1f} logins/s, GET /profile p50 {:.1f} ms, max {:.1f} ms".format(
+        logins / seconds, latencies[len(latencies) // 2] * 1000,
+        latencies[-1] * 1000))
+
+
+if __name__ == "__main__":
+    args = worker_args()
+    if args is not None:
+        run(int(args[0]))
+        sys.exit()
+
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    print("{} concurrent logins:".format(logins))
+    for mode, result in run_modes(__file__, MODES, logins, env=ENV):
+        print("  {:<7} {}".format(mode, result.strip()))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+""" Latency of DB.find_session, by primary key, and of DB.find_user_by on
+the reset_token column, with and without its index, by table size
+
+Usage: ./bench_find_user.py [size...]  (default: 1000 10000 100000)
+"""
+from os import chdir
+import sys
+import tempfile
+import time
+import uuid
+
+
+LOOKUPS = 200
+
+
+def timed(db, find, *args, **kwargs) -> float:
+    """ Milliseconds per find(*args, **kwargs), a lookup method of db
+    """
+    start = time.perf_counter()
+    for _ in range(LOOKUPS):
+        find(*args, **kwargs)
+        db.close_session()
+    return (time.perf_counter() - start) / LOOKUPS * 1000
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    with tempfile.TemporaryDirectory() as tmp:
+        # The default DB_URL is a.db in the current directory
+        chdir(tmp)
+        from db import DB
+        from user import User
+        from user_session import UserSession
+
+        db = DB()
+        table = User.__table__
+        print("ms per lookup:")
+        print("  {:>7}  {:>8}  {:>17}".format("users", "session",
+                                              "reset_token"))
+        print("  {:>7}  {:>8}  {:>8} {:>8}".format(
+            "", "id", "index", "scan"))
+        count = 0
+        for size in sizes:
+            rows = [{'id': i + 1, 'email': 'u{}@x.io'.format(i),
+                     'hashed_password': 'h',
+                     'reset_token': str(uuid.uuid4())}
+                    for i in range(count, size)]
+            sessions = [{'id': str(uuid.uuid4()), 'user_id': row['id']}
+                        for row in rows]
+            with db._engine.begin() as connection:
+                connection.execute(table.insert(), rows)
+                connection.execute(UserSession.__table__.insert(), sessions)
+            count = size
+            session_id = sessions[len(sessions) // 2]['id']
+            reset_token = rows[len(rows) // 2]['reset_token']
+
+            results = {'session': timed(db, db.find_session, session_id)}
+            for indexed in (True, False):
+                with db._engine.begin() as connection:
+                    for index in table.indexes:
+                        if indexed:
+                            index.create(connection, checkfirst=True)
+                        else:
+                            index.drop(connection, checkfirst=True)
+                results[indexed] = timed(db, db.find_user_by,
+                                         reset_token=reset_token)
+            print("  {:>7}  {:8.3f}  {:8.3f} {:8.3f}".format(
+                size, results['session'], results[True], results[False]))
+        db._engine.dispose()
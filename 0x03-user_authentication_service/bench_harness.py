@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+""" Harness of the benchmarks comparing settings: as the settings are read
+at import, each mode runs the benchmark script again in its own process
+and temporary directory, with `--run` and the settings of the mode in its
+environment
+"""
+from os import environ, path
+from typing import Iterator, List, Tuple
+import subprocess
+import sys
+import tempfile
+
+
+def worker_args() -> List[str]:
+    """ Return the arguments of a benchmark run by run_modes, None in the
+    parent process
+    """
+    if sys.argv[1:2] == ['--run']:
+        return sys.argv[2:]
+    return None
+
+
+def run_modes(script: str, modes: dict, *args,
+              env: dict = {}) -> Iterator[Tuple[str, str]]:
+    """ Run `script` with `args` once per mode, with the environment
+    settings of the mode on top of `env`, and yield each mode with the
+    output of its run (its errors go to stderr)
+    """
+    script = path.abspath(script)
+    for mode, settings in modes.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            result = subprocess.run(
+                [sys.executable, script, '--run'] + [str(a) for a in args],
+                cwd=tmp, env={**environ, **env, **settings}, check=True,
+                stdout=subprocess.PIPE, text=True).stdout
+        yield mode, result.rstrip()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+""" Latency of GET /profile with and without the session cache of Auth
+
+Each mode runs the app in its own process (see bench_harness.py).
+
+Usage: ./bench_profile.py [requests]  (default: 2000)
+"""
+from bench_harness import run_modes, worker_args
+import sys
+import time
+
+
+MODES = {
+    'no cache': {'SESSION_CACHE_SIZE': '0'},
+    'cache': {},
+}
+EMAIL = "bob@bob.com"
+PASSWORD = "mySuperPwd"
+USERS = 10000
+
+
+def run(count: int):
+    """ Log in among USERS users, time `count` GET /profile and print the
+    results
+    """
+    from app import app, AUTH
+    from user import User
+    client = app.test_client()
+    assert client.post("/users", data={"email": EMAIL,
+                                       "password": PASSWORD}).status_code \
+        == 200
+    with AUTH._db._engine.begin() as connection:
+        connection.execute(User.__table__.insert(),
+                           [{'email': 'u{}@x.io'.format(i),
+                             'hashed_password': 'h'} for i in range(USERS)])
+    assert client.post("/sessions", data={"email": EMAIL,
+                                          "password": PASSWORD}).status_code \
+        == 200
+
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = client.get("/profile")
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    latencies.sort()
+    print("p50 {:.3f} ms, p99 {:.3f} ms, {:.0f} requests/s, "
+          "hit ratio {:.2f}".format(
+              latencies[count // 2] * 1000,
+              latencies[count * 99 // 100] * 1000, count / sum(latencies),
+              AUTH.cache_stats()['hit_ratio']))
+
+
+if __name__ == "__main__":
+    args = worker_args()
+    if args is not None:
+        run(int(args[0]))
+        sys.exit()
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print("GET /profile x {}:".format(count))
+    for mode, result in run_modes(__file__, MODES, count,
+                                  env={'BCRYPT_WORKERS': '0'}):
+        print("  {:<9} {}".format(mode, result.strip()))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+""" Login and profile throughput of Auth for each DB_SQLITE_PROFILE preset:
+logins alone, session lookups alone, then both at once
+
+Each preset runs in its own process (see bench_harness.py). bcrypt runs
+inline with the cheapest cost, and the session cache is off, so that the
+database dominates.
+
+Usage: ./bench_sqlite.py [seconds per run]  (default: 3)
+"""
+from bench_harness import run_modes, worker_args
+import sys
+import threading
+import time
+
+
+PROFILES = ['none', 'durable', 'fast']
+ENV = {'BCRYPT_WORKERS': '0', 'SESSION_CACHE_SIZE': '0',
+       'SESSION_SWEEP_INTERVAL': '0'}
+USERS = 1000
+THREADS = 4
+PASSWORD = "pwd"
+
+
+def run(auth, session_ids: list, seconds: float, logins: int,
+        profiles: int) -> tuple:
+    """ Logins and session lookups per second of `logins` and `profiles`
+    threads during `seconds`
+    """
+    counts = {'login': 0, 'profile': 0}
+    stop = time.monotonic() + seconds
+
+    def login(i):
+        while time.monotonic() < stop:
+            assert auth.login("u{}@x.io".format(i % USERS), PASSWORD)
+            auth.teardown()
+            counts['login'] += 1
+            i += 7
+
+    def profile(i):
+        while time.monotonic() < stop:
+            assert auth.get_user_from_session_id(session_ids[i % USERS])
+            auth.teardown()
+            counts['profile'] += 1
+            i += 13
+
+    threads = [threading.Thread(target=login, args=(i,))
+               for i in range(logins)] + \
+        [threading.Thread(target=profile, args=(i,))
+         for i in range(profiles)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts['login'] / seconds, counts['profile'] / seconds
+
+
+def bench(seconds: float):
+    """ Create USERS users with a session each, then print the throughputs
+    """
+    from auth import Auth
+    from user import User
+    import bcrypt
+    auth = Auth()
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(4))
+    with auth._db._engine.begin() as connection:
+        connection.execute(User.__table__.insert(),
+                           [{'email': 'u{}@x.io'.format(i),
+                             'hashed_password': hashed}
+                            for i in range(USERS)])
+    session_ids = []
+    for i in range(USERS):
+        session_ids.append(auth.login("u{}@x.io".format(i), PASSWORD))
+        auth.teardown()
+
+    logins = run(auth, session_ids, seconds, THREADS, 0)[0]
+    profiles = run(auth, session_ids, seconds, 0, THREADS)[1]
+    mixed = run(auth, session_ids, seconds, THREADS, THREADS)
+    print("{:6.0f} {:8.0f}   {:6.0f} {:8.0f}".format(
+        logins, profiles, *mixed))
+
+
+if __name__ == "__main__":
+    args = worker_args()
+    if args is not None:
+        bench(float(args[0]))
+        sys.exit()
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print("{} threads, per second:".format(THREADS))
+    print("{:<9} {:<15}   {}".format("", "alone", "mixed"))
+    print("{:<9} {:>6} {:>8}   {:>6} {:>8}".format(
+        "", "logins", "profiles", "logins", "profiles"))
+    modes = {profile: {'DB_SQLITE_PROFILE': profile} for profile in PROFILES}
+    for profile, result in run_modes(__file__, modes, seconds, env=ENV):
+        print("{:<9} {}".format(profile, result))
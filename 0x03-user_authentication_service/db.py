@@ -3,35 +3,386 @@
 Database interaction class using SQLAlchemy.
 """
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import multiprocessing
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from sqlalchemy import (Column, Integer, Table, create_engine, delete,
+                        event, inspect, or_, select, text, update)
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm.exc import NoResultFound
 from user import Base, User
+from user_session import UserSession
+
+
+def _getenv_number(name: str, default, cast=int):
+    """Read a numeric setting from the environment."""
+    try:
+        return cast(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# Connection pool of the engine: DB_POOL_SIZE connections kept open, up to
+# DB_MAX_OVERFLOW more under load, waited for at most DB_POOL_TIMEOUT seconds
+DB_POOL_SIZE = _getenv_number("DB_POOL_SIZE", 5)
+DB_MAX_OVERFLOW = _getenv_number("DB_MAX_OVERFLOW", 10)
+DB_POOL_TIMEOUT = _getenv_number("DB_POOL_TIMEOUT", 30.0, float)
+DB_URL = os.getenv("DB_URL", "sqlite:///a.db")
+# "reset" recreates the tables on startup, "persistent" keeps the data and
+# only creates the missing tables, then upgrades the schema if needed
+DB_MODE = os.getenv("DB_MODE", "reset")
+# Group commit: transactions that write share one commit, made once
+# DB_GROUP_COMMIT_SIZE of them are done, no other transaction is running,
+# or after waiting at most DB_GROUP_COMMIT_WINDOW seconds (disabled when 0)
+DB_GROUP_COMMIT_WINDOW = _getenv_number("DB_GROUP_COMMIT_WINDOW", 0.0, float)
+DB_GROUP_COMMIT_SIZE = _getenv_number("DB_GROUP_COMMIT_SIZE", 32)
+# PRAGMAs run on each new SQLite connection, from the DB_SQLITE_PROFILE
+# preset, each overridable by DB_SQLITE_<PRAGMA> (e.g. DB_SQLITE_SYNCHRONOUS).
+# WAL lets readers run during a write; "durable" syncs every commit,
+# "fast" only checkpoints, so that a power loss may lose the last commits
+# but never corrupts the database; "none" keeps the SQLite defaults.
+SQLITE_PROFILES = {
+    'none': {},
+    'durable': {'journal_mode': 'WAL', 'synchronous': 'FULL',
+                'cache_size': -16384, 'mmap_size': 268435456,
+                'busy_timeout': 5000},
+    'fast': {'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+             'cache_size': -16384, 'mmap_size': 268435456,
+             'busy_timeout': 5000},
+}
+DB_SQLITE_PROFILE = os.getenv("DB_SQLITE_PROFILE", "durable")
+SQLITE_PRAGMAS = dict(SQLITE_PROFILES.get(DB_SQLITE_PROFILE,
+                                          SQLITE_PROFILES['durable']))
+for _pragma in ('journal_mode', 'synchronous', 'cache_size', 'mmap_size',
+                'busy_timeout'):
+    _value = os.getenv("DB_SQLITE_" + _pragma.upper())
+    # Only plain numbers and keywords, as they are inlined in the PRAGMA
+    if _value is not None and re.fullmatch(r"-?\w+", _value):
+        SQLITE_PRAGMAS[_pragma] = _value
+
+# Version of the schema declared by the models, stored in schema_version.
+# MIGRATIONS[n] upgrades a database from version n - 1 to n.
+SCHEMA_VERSION = 3
+schema_version = Table('schema_version', Base.metadata,
+                       Column('version', Integer, nullable=False))
+
+
+def _create_user_indexes(connection) -> None:
+    """Version 2: index the reset_token lookups."""
+    for index in User.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _move_sessions(connection) -> None:
+    """
+    Version 3: move the session IDs of the users to the sessions table,
+    without expiry as before, and drop the index of the unused column.
+    """
+    connection.execute(text(
+        "INSERT INTO sessions (id, user_id, expires_at) "
+        "SELECT session_id, id, NULL FROM users "
+        "WHERE session_id IS NOT NULL"))
+    connection.execute(text(
+        "UPDATE users SET session_id = NULL WHERE session_id IS NOT NULL"))
+    connection.execute(text("DROP INDEX IF EXISTS ix_users_session_id"))
+
+
+MIGRATIONS = {2: _create_user_indexes, 3: _move_sessions}
+
+
+def _utcnow() -> datetime:
+    """Return the current naive UTC date, as stored in the database."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Run SQLITE_PRAGMAS on a new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+    finally:
+        cursor.close()
+
+
+class _SerializedStaticPool(StaticPool):
+    """
+    StaticPool lending its one connection (an in-memory database) to one
+    thread at a time, from checkout to checkin, as the sessions of all
+    threads would otherwise share its transaction. A thread must return
+    the connection before checking it out again.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        """Initialize the pool and the lock of its connection."""
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def _do_get(self):
+        """Wait for the connection, before it is handed out."""
+        self._lock.acquire()
+        try:
+            return super()._do_get()
+        except BaseException:
+            self._lock.release()
+            raise
+
+    def _do_return_conn(self, record) -> None:
+        """Let the next thread check out the connection."""
+        super()._do_return_conn(record)
+        self._lock.release()
+
+
+def _engine_options(url: str) -> dict:
+    """Return the create_engine options of a database URL."""
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite' and \
+            url.database in (None, '', ':memory:'):
+        # One in-memory database shared by all threads, one at a time
+        return {'poolclass': _SerializedStaticPool,
+                'connect_args': {'check_same_thread': False}}
+    # Explicit, as SQLAlchemy < 2.0 defaults to a NullPool for SQLite files
+    options = {'poolclass': QueuePool, 'pool_size': DB_POOL_SIZE,
+               'max_overflow': DB_MAX_OVERFLOW,
+               'pool_timeout': DB_POOL_TIMEOUT}
+    if url.get_backend_name() == 'sqlite':
+        # Pooled connections move between the request threads
+        options['connect_args'] = {'check_same_thread': False}
+    return options
 
 
 class DB:
     """
     DB class for managing database operations.
+    Each thread gets its own session, released by close_session.
+    The database is DB_URL, reset on startup unless DB_MODE is persistent,
+    tuned by SQLITE_PRAGMAS when it is SQLite.
+    Methods commit right away, unless called inside transaction().
     Methods:
+        close_session: Releases the session of the current thread.
+        transaction: Groups lookups and writes in one unit of work.
         add_user: Adds a new user to the database.
         find_user_by: Finds a user based on specified criteria.
         update_user: Updates attributes of an existing user.
+        add_session: Adds a session of a user.
+        find_session: Finds an unexpired session by ID.
+        remove_sessions: Removes one or all sessions of a user.
+        remove_expired_sessions: Removes a batch of expired sessions.
     """
     def __init__(self) -> None:
-        """Initialize a new DB instance with an SQLite database."""
-        self._engine = create_engine("sqlite:///a.db", echo=False)
-        Base.metadata.drop_all(self._engine)
+        """Initialize a new DB instance on DB_URL."""
+        if multiprocessing.parent_process() is not None:
+            # A worker importing the app again would reset the database
+            raise RuntimeError("DB created in a worker process")
+        self._engine = create_engine(DB_URL, echo=False,
+                                     **_engine_options(DB_URL))
+        if self._engine.dialect.name == 'sqlite':
+            event.listen(self._engine, "connect", _set_sqlite_pragmas)
+        if DB_MODE != 'persistent':
+            Base.metadata.drop_all(self._engine)
+        # Tables created before the schema version was tracked: version 1
+        untracked = set(inspect(self._engine).get_table_names()) & \
+            set(Base.metadata.tables) - {schema_version.name}
         Base.metadata.create_all(self._engine)
-        self.__session = None
+        self._upgrade_schema(1 if untracked else SCHEMA_VERSION)
+        self.__session = scoped_session(sessionmaker(bind=self._engine))
+        self._local = threading.local()
+        # Group commit: the transactions that write take turns on a
+        # shared writer session, each in a savepoint, until it commits.
+        # Its connection is its own, so that it never waits for one held
+        # by a transaction waiting for it; disabled with a StaticPool (an
+        # in-memory database), where all sessions share one connection.
+        self._group_commit = DB_GROUP_COMMIT_WINDOW > 0 and \
+            not isinstance(self._engine.pool, StaticPool)
+        self._writer = None
+        self._writer_owner = None
+        self._writer_running = 0
+        self._writer_batch = {'done': False, 'error': None, 'size': 0}
+        self._writer_condition = threading.Condition()
+
+    def _upgrade_schema(self, untracked_version: int) -> None:
+        """
+        Bring the database to SCHEMA_VERSION.
+        Args:
+            untracked_version (int): Version of a database without one.
+        Raises:
+            RuntimeError: If the database is newer than the models.
+        """
+        with self._engine.begin() as connection:
+            version = connection.execute(
+                select(schema_version.c.version)).scalar()
+            if version is None:
+                version = untracked_version
+                connection.execute(schema_version.insert().values(
+                    version=version))
+            if version > SCHEMA_VERSION:
+                raise RuntimeError(f"Database schema version {version} is "
+                                   f"newer than {SCHEMA_VERSION}")
+            for step in range(version + 1, SCHEMA_VERSION + 1):
+                MIGRATIONS[step](connection)
+            if version < SCHEMA_VERSION:
+                connection.execute(schema_version.update().values(
+                    version=SCHEMA_VERSION))
 
     @property
     def _session(self):
-        """Return a database session, creating one if necessary."""
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
-            self.__session = DBSession()
-        return self.__session
+        """
+        Return the database session of the current thread, or the writer
+        session while its transaction is writing there.
+        """
+        if getattr(self._local, 'savepoint', None) is not None:
+            return self._writer
+        return self.__session()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the enclosed lookups and writes as one unit of work: methods
+        called inside don't commit, the whole is committed at the end and
+        rolled back on exception. Nested transactions join the outer one.
+        With group commit, the writes go to the writer session from the
+        first one on, and the end waits for the shared commit.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        if depth == 0 and self._group_commit:
+            with self._writer_condition:
+                self._writer_running += 1
+            self._local.running = True
+        try:
+            yield
+            if depth == 0:
+                self._commit()
+        except BaseException:
+            if depth == 0:
+                self._rollback()
+            raise
+        finally:
+            self._local.depth = depth
+            if depth == 0 and self._group_commit:
+                with self._writer_condition:
+                    self._stop_running()
+
+    def _write_session(self):
+        """
+        Return the session to write to, taking the turn on the writer
+        session inside a transaction with group commit.
+        """
+        if not self._group_commit or \
+                getattr(self._local, 'savepoint', None) is not None:
+            return self._session
+        with self._writer_condition:
+            while self._writer_owner is not None:
+                self._writer_condition.wait()
+            self._writer_owner = threading.get_ident()
+        try:
+            if self._writer is None:
+                self._writer = Session(bind=self._engine.connect(),
+                                       expire_on_commit=False)
+            if not self._writer.in_transaction() and \
+                    self._engine.dialect.name == 'sqlite':
+                # pysqlite only begins before DML: without a BEGIN, the
+                # first savepoint would commit on release
+                self._writer.connection().exec_driver_sql("BEGIN")
+            self._local.savepoint = self._writer.begin_nested()
+        except BaseException:
+            self._release_writer()
+            raise
+        return self._writer
+
+    def _stop_running(self) -> None:
+        """
+        Count the transaction of the current thread out of the running
+        ones that a batch waits for, holding the writer condition.
+        """
+        if getattr(self._local, 'running', False):
+            self._local.running = False
+            self._writer_running -= 1
+            self._writer_condition.notify_all()
+
+    def _release_writer(self) -> None:
+        """Give the turn on the writer session to another transaction."""
+        with self._writer_condition:
+            self._writer_owner = None
+            self._writer_condition.notify_all()
+
+    def _commit(self) -> None:
+        """Commit the transaction of the current thread."""
+        self.__session().commit()
+        savepoint = getattr(self._local, 'savepoint', None)
+        if savepoint is None:
+            return
+        self._local.savepoint = None
+        try:
+            savepoint.commit()
+        except BaseException:
+            self._release_writer()
+            raise
+        with self._writer_condition:
+            self._writer_owner = None
+            self._stop_running()
+            batch = self._writer_batch
+            batch['size'] += 1
+            deadline = time.monotonic() + DB_GROUP_COMMIT_WINDOW
+            while not batch['done']:
+                remaining = deadline - time.monotonic()
+                if self._writer_owner is None and \
+                        (batch['size'] >= DB_GROUP_COMMIT_SIZE or
+                         self._writer_running == 0 or remaining <= 0):
+                    self._commit_writer()
+                    break
+                self._writer_condition.wait(
+                    remaining if remaining > 0 else None)
+        if batch['error'] is not None:
+            raise batch['error']
+
+    def _commit_writer(self) -> None:
+        """Commit the current batch of the writer, holding its condition."""
+        batch = self._writer_batch
+        try:
+            self._writer.commit()
+        except Exception as error:
+            # A failed COMMIT may leave the connection inside its
+            # transaction, out of reach of a rollback of the session:
+            # drop both, the next transaction opens new ones
+            connection = self._writer.bind
+            self._writer.close()
+            self._writer = None
+            connection.invalidate()
+            connection.close()
+            batch['error'] = error
+        finally:
+            if self._writer is not None:
+                self._writer.expunge_all()
+            batch['done'] = True
+            self._writer_batch = {'done': False, 'error': None, 'size': 0}
+            self._writer_condition.notify_all()
+
+    def _rollback(self) -> None:
+        """Roll back the transaction of the current thread."""
+        savepoint = getattr(self._local, 'savepoint', None)
+        if savepoint is None:
+            self.__session().rollback()
+            return
+        self._local.savepoint = None
+        try:
+            savepoint.rollback()
+        finally:
+            self._release_writer()
+
+    def close_session(self) -> None:
+        """
+        Release the session of the current thread, returning its
+        connection to the pool. The next query opens a new one.
+        """
+        self.__session.remove()
 
     def add_user(self, email: str, hashed_password: str) -> User:
         """
@@ -43,8 +394,10 @@ class DB:
             User: The created User object.
         """
         user = User(email=email, hashed_password=hashed_password)
-        self._session.add(user)
-        self._session.commit()
+        with self.transaction():
+            session = self._write_session()
+            session.add(user)
+            session.flush()
         return user
 
     def find_user_by(self, **kwargs) -> User:
@@ -62,18 +415,96 @@ class DB:
         except InvalidRequestError:
             raise InvalidRequestError
 
-    def update_user(self, user_id: int, **kwargs) -> None:
+    def update_user(self, user_id: int, expected: dict = None,
+                    **kwargs) -> int:
         """
-        Update a user's attributes.
+        Update a user's attributes in a single UPDATE statement.
         Args:
             user_id (int): The ID of the user to update.
+            expected (dict): Attribute values the user must still have
+                to be updated, e.g. read before a slow computation.
             kwargs: Key-value pairs of attributes to update.
+        Returns:
+            int: The number of updated users, 0 if none has this ID (and
+            the expected values).
         Raises:
             ValueError: If an invalid attribute is provided.
         """
-        user = self.find_user_by(id=user_id)
-        for key, value in kwargs.items():
-            if not hasattr(user, key):
+        expected = expected or {}
+        columns = User.__table__.columns
+        for key in list(kwargs) + list(expected):
+            if key not in columns:
                 raise ValueError(f"{key} is not a valid attribute of User.")
-            setattr(user, key, value)
-        self._session.commit()
+        if not kwargs:
+            raise ValueError("No attribute to update.")
+        statement = update(User).where(User.id == user_id)
+        for key, value in expected.items():
+            statement = statement.where(columns[key] == value)
+        with self.transaction():
+            return self._write_session().execute(
+                statement.values(**kwargs)
+                .execution_options(synchronize_session=False)).rowcount
+
+    def add_session(self, session_id: str, user_id: int,
+                    expires_at: datetime = None) -> UserSession:
+        """
+        Add a session to the database.
+        Args:
+            session_id (str): The session ID.
+            user_id (int): The ID of the logged in user.
+            expires_at (datetime): UTC expiry date, None for no expiry.
+        Returns:
+            UserSession: The created UserSession object.
+        """
+        user_session = UserSession(id=session_id, user_id=user_id,
+                                   expires_at=expires_at)
+        with self.transaction():
+            session = self._write_session()
+            session.add(user_session)
+            session.flush()
+        return user_session
+
+    def find_session(self, session_id: str) -> UserSession:
+        """
+        Find an unexpired session, along with its user.
+        Args:
+            session_id (str): The session ID.
+        Returns:
+            UserSession: The found UserSession object.
+        Raises:
+            NoResultFound: If the session doesn't exist or has expired.
+        """
+        return self._session.query(UserSession).filter(
+            UserSession.id == session_id,
+            or_(UserSession.expires_at.is_(None),
+                UserSession.expires_at > _utcnow())).one()
+
+    def remove_sessions(self, user_id: int, session_id: str = None) -> int:
+        """
+        Remove one session of a user, or all of them.
+        Args:
+            user_id (int): The ID of the user.
+            session_id (str): The session ID, None for all of them.
+        Returns:
+            int: The number of removed sessions.
+        """
+        statement = delete(UserSession).where(UserSession.user_id == user_id)
+        if session_id is not None:
+            statement = statement.where(UserSession.id == session_id)
+        with self.transaction():
+            return self._write_session().execute(
+                statement.execution_options(
+                    synchronize_session=False)).rowcount
+
+    def remove_expired_sessions(self, limit: int) -> int:
+        """
+        Remove up to `limit` expired sessions, in one short transaction.
+        Returns:
+            int: The number of removed sessions.
+        """
+        expired = select(UserSession.id).where(
+            UserSession.expires_at <= _utcnow()).limit(limit)
+        with self.transaction():
+            return self._write_session().execute(delete(UserSession).where(
+                UserSession.id.in_(expired)).execution_options(
+                    synchronize_session=False)).rowcount
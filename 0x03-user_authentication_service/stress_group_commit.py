@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+""" Concurrency checks of the group commit of DB.transaction()
+
+With group commit on, threads run units of work that add users, then the
+checks are:
+- concurrent units share COMMITs, and all their users are stored
+- a unit whose savepoint fails raises alone, the others are stored
+- a failing COMMIT is raised in every unit of its batch, none is stored,
+  and the next units are stored again
+- a lone writer doesn't wait for the window before its COMMIT
+
+Each run has its own process (see bench_harness.py).
+
+Usage: ./stress_group_commit.py [runs]  (default: 3)
+"""
+from bench_harness import run_modes, worker_args
+import sys
+import threading
+import time
+
+
+WINDOW = 0.05
+MODES = {
+    'durable': {'DB_GROUP_COMMIT_WINDOW': str(WINDOW),
+                'DB_SQLITE_PROFILE': 'durable'},
+    'fast': {'DB_GROUP_COMMIT_WINDOW': str(WINDOW),
+             'DB_SQLITE_PROFILE': 'fast'},
+}
+UNITS = 16
+LONE_UNITS = 50
+
+
+def units(db, emails: list) -> list:
+    """ Run one unit adding a user per email, each in its own thread,
+    started at once. Return the exception raised by each unit, or None.
+    """
+    errors = [None] * len(emails)
+    barrier = threading.Barrier(len(emails))
+
+    def unit(i):
+        barrier.wait()
+        try:
+            with db.transaction():
+                db.add_user(emails[i], 'h')
+        except Exception as e:
+            errors[i] = e
+        finally:
+            db.close_session()
+
+    threads = [threading.Thread(target=unit, args=(i,))
+               for i in range(len(emails))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def stored(db, emails: list) -> list:
+    """ Return which of the emails have a user in the database
+    """
+    from user import User
+    with db._engine.connect() as connection:
+        found = {row[0] for row in connection.execute(
+            User.__table__.select().with_only_columns(User.email))}
+    return [email in found for email in emails]
+
+
+def run():
+    """ Run the checks and print their results
+    """
+    from db import DB
+    from sqlalchemy import event
+    from sqlalchemy.exc import IntegrityError
+
+    db = DB()
+    assert db._group_commit, "group commit is off"
+    # Units only write, through the writer session: each COMMIT is one of
+    # a batch
+    commits = []
+    failing = threading.Event()
+
+    def on_commit(connection):
+        commits.append(connection)
+        if failing.is_set():
+            raise RuntimeError("COMMIT failed")
+
+    event.listen(db._engine, "commit", on_commit)
+
+    # Concurrent units share COMMITs
+    emails = ['shared{}@x.io'.format(i) for i in range(UNITS)]
+    errors = units(db, emails)
+    assert errors == [None] * UNITS, errors
+    assert all(stored(db, emails))
+    assert len(commits) < UNITS, "no COMMIT shared"
+    shared = len(commits)
+
+    # A failing savepoint only rolls back its own unit
+    emails = ['shared0@x.io'] + ['savepoint{}@x.io'.format(i)
+                                 for i in range(1, UNITS)]
+    errors = units(db, emails)
+    assert isinstance(errors[0], IntegrityError), errors[0]
+    assert errors[1:] == [None] * (UNITS - 1), errors
+    assert all(stored(db, emails[1:]))
+
+    # A failing COMMIT is raised in every unit of its batch
+    emails = ['failed{}@x.io'.format(i) for i in range(UNITS)]
+    failing.set()
+    errors = units(db, emails)
+    failing.clear()
+    assert all(isinstance(e, RuntimeError) for e in errors), errors
+    assert not any(stored(db, emails))
+    errors = units(db, emails)
+    assert errors == [None] * UNITS, errors
+    assert all(stored(db, emails))
+
+    # A lone writer commits right away
+    latencies = []
+    for i in range(LONE_UNITS):
+        start = time.perf_counter()
+        with db.transaction():
+            db.add_user('lone{}@x.io'.format(i), 'h')
+        latencies.append(time.perf_counter() - start)
+    db.close_session()
+    latencies.sort()
+    lone = latencies[LONE_UNITS // 2]
+    assert lone < WINDOW / 2, "lone writer waited {:.1f} ms".format(
+        lone * 1000)
+
+    print("ok, {} units in {} COMMITs, lone writer p50 {:.1f} ms "
+          "(window {:.0f} ms)".format(UNITS, shared, lone * 1000,
+                                      WINDOW * 1000))
+
+
+if __name__ == "__main__":
+    args = worker_args()
+    if args is not None:
+        run()
+        sys.exit()
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    for i in range(runs):
+        for mode, result in run_modes(__file__, MODES):
+            print("{:<8} {}".format(mode, result))
@@ -16,8 +16,10 @@ class User(Base):
         id (int): The primary key.
         email (str): The user's email address (unique).
         hashed_password (str): The hashed password for the user.
-        session_id (str): Session ID for the user (optional).
-        reset_token (str): Reset token for password resets (optional).
+        session_id (str): Legacy session ID, moved to the sessions table
+            (see UserSession).
+        reset_token (str): Reset token for password resets (optional,
+            indexed).
     """
     __tablename__ = 'users'
 
@@ -25,4 +27,4 @@ class User(Base):
     email = Column(String(250), nullable=False, unique=True)
     hashed_password = Column(String(250), nullable=False)
     session_id = Column(String(250), nullable=True)
-    reset_token = Column(String(250), nullable=True)
+    reset_token = Column(String(250), nullable=True, index=True)
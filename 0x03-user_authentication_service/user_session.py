@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+UserSession model definition for SQLAlchemy.
+"""
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy.orm import relationship
+from user import Base, User
+
+
+class UserSession(Base):
+    """
+    UserSession model that maps to the 'sessions' table.
+    Attributes:
+        id (str): The session ID, primary key.
+        user_id (int): The ID of the logged in user (indexed).
+        expires_at (datetime): Expiry date in UTC, None if the session
+            never expires (indexed).
+        user (User): The logged in user, loaded with the session.
+    """
+    __tablename__ = 'sessions'
+
+    id = Column(String(250), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'),
+                     nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
+    user = relationship(User, lazy='joined')